@@ -1,10 +1,102 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse
+from app.core import config
 from app.services import categories, products, modifications
+from app.services import webhooks, stock, json_stream
+from app.services.catalog import catalog_cache
+from app.services.metrics import metrics
+from app.services.reference import reference_cache
 from app.logger import logger
 
 router = APIRouter()
 
+def check_webhook_token(token: str):
+    # МойСклад не подписывает вебхуки, поэтому секрет передаётся в URL подписки.
+    # Без секрета любой мог бы удалять строки событиями DELETE или регистрировать вебхуки на чужой URL
+    if not config.WEBHOOK_SECRET:
+        raise HTTPException(status_code=403, detail="Вебхуки недоступны: не задан WEBHOOK_SECRET")
+    if token != config.WEBHOOK_SECRET:
+        raise HTTPException(status_code=403, detail="Неверный токен вебхука")
+
 @router.get("/health")
 async def health():
     logger.info("Healthcheck пройден")
     return {"status": "ok"}
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    # Текстовый формат экспозиции Prometheus 0.0.4
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@router.get("/sync/runs")
+async def sync_runs(limit: int = 20):
+    return {"runs": metrics.recent_runs(limit)}
+
+@router.post("/sync/stock")
+async def sync_stock():
+    summary = await stock.refresh_stock()
+    if summary is None:
+        return {"status": "skipped", "detail": "Синхронизация уже выполняется"}
+    return {"status": "ok", **summary}
+
+@router.post("/reference/invalidate")
+async def invalidate_reference(kind: str = None):
+    if kind and kind not in reference_cache.LOADERS:
+        raise HTTPException(status_code=404, detail=f"Неизвестный справочник: {kind}")
+    reference_cache.invalidate(kind)
+    return {"status": "ok"}
+
+async def catalog_snapshot():
+    if not config.CATALOG_CACHE_ENABLED:
+        raise HTTPException(status_code=404, detail="API каталога отключено")
+    try:
+        return await catalog_cache.get()
+    except Exception as e:
+        logger.error(f"Каталог для API недоступен: {str(e)}")
+        raise HTTPException(status_code=503, detail="Каталог ещё не загружен")
+
+def catalog_response(request: Request, version: str, build_payload) -> Response:
+    # ETag - версия снимка: пока каталог не пересобран с изменениями, клиент получает 304 без тела
+    etag = f'W/"{version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(json_stream.dumps(build_payload()), media_type="application/json", headers=headers)
+
+@router.get("/catalog/categories")
+async def catalog_categories(request: Request):
+    snapshot = await catalog_snapshot()
+    return catalog_response(request, snapshot.version, snapshot.category_tree)
+
+@router.get("/catalog/categories/{category_id}/products")
+async def catalog_category_products(request: Request, category_id: str, offset: int = Query(0, ge=0),
+                                    limit: int = Query(50, ge=1), compact: bool = False):
+    snapshot = await catalog_snapshot()
+    if category_id not in snapshot.categories:
+        raise HTTPException(status_code=404, detail="Категория не найдена")
+    limit = min(limit, config.CATALOG_MAX_PAGE_SIZE)
+    return catalog_response(
+        request, snapshot.version,
+        lambda: snapshot.category_products(category_id, offset, limit, compact),
+    )
+
+@router.get("/catalog/products/{product_id}")
+async def catalog_product(request: Request, product_id: str):
+    snapshot = await catalog_snapshot()
+    if product_id not in snapshot.products:
+        raise HTTPException(status_code=404, detail="Товар не найден")
+    return catalog_response(request, snapshot.version, lambda: snapshot.product(product_id))
+
+@router.post("/webhooks/moysklad")
+async def moysklad_webhook(request: Request, token: str = None):
+    check_webhook_token(token)
+    payload = await request.json()
+    # Только ставим события в очередь: МойСклад ждёт быстрый ответ
+    count = webhooks.handle_payload(payload)
+    return {"status": "accepted", "events": count}
+
+@router.post("/webhooks/moysklad/register")
+async def register_moysklad_webhooks(callback_url: str, token: str = None):
+    check_webhook_token(token)
+    created = await webhooks.register_webhooks(callback_url)
+    return {"status": "ok", "created": created}
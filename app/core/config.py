@@ -11,3 +11,114 @@ MS_BASE_URL = os.getenv("MS_BASE_URL")
 MS_TOKEN = os.getenv("MS_TOKEN")
 
 SYNC_INTERVAL_SECONDS = int(os.getenv("SYNC_INTERVAL_SECONDS", 600))
+
+# Размер страницы отчёта об остатках (МойСклад допускает до 1000 строк)
+STOCK_PAGE_LIMIT = int(os.getenv("STOCK_PAGE_LIMIT", 1000))
+
+# Пагинация коллекций МойСклад: размер страницы (максимум 1000) и число страниц, качаемых параллельно
+MS_PAGE_LIMIT = int(os.getenv("MS_PAGE_LIMIT", 1000))
+MS_PAGE_CONCURRENCY = int(os.getenv("MS_PAGE_CONCURRENCY", 4))
+
+# Общий HTTP-клиент: пул соединений, keep-alive, таймауты (секунды) и HTTP/2
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 20))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 10))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 30))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 10))
+HTTP2 = os.getenv("HTTP2", "true").lower() in ("1", "true", "yes")
+
+# Пакетная запись в Supabase: строк в одном upsert и максимальная задержка отправки (секунды)
+SUPABASE_BATCH_SIZE = int(os.getenv("SUPABASE_BATCH_SIZE", 500))
+SUPABASE_FLUSH_INTERVAL = float(os.getenv("SUPABASE_FLUSH_INTERVAL", 5))
+# Повторы записи при временных ошибках Supabase (таймауты, 5xx) и экспоненциальная задержка (секунды)
+SUPABASE_WRITE_RETRIES = int(os.getenv("SUPABASE_WRITE_RETRIES", 4))
+SUPABASE_BACKOFF_BASE = float(os.getenv("SUPABASE_BACKOFF_BASE", 1))
+SUPABASE_BACKOFF_MAX = float(os.getenv("SUPABASE_BACKOFF_MAX", 30))
+
+# Инкрементальная синхронизация: часовой пояс дат МойСклад, перекрытие отметки (секунды)
+# и период полной сверки всего каталога
+MS_TIMEZONE = os.getenv("MS_TIMEZONE", "Europe/Moscow")
+SYNC_WATERMARK_OVERLAP_SECONDS = int(os.getenv("SYNC_WATERMARK_OVERLAP_SECONDS", 60))
+FULL_SYNC_INTERVAL_SECONDS = int(os.getenv("FULL_SYNC_INTERVAL_SECONDS", 86400))
+
+# Каталог для локальных служебных данных (кэши, манифесты)
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+# Манифест изображений: максимальное число записей на диске
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", 200000))
+
+# Стадия изображений: число параллельных загрузок и размер очереди (ограничивает память)
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 4))
+IMAGE_QUEUE_SIZE = int(os.getenv("IMAGE_QUEUE_SIZE", 100))
+
+# Перекодирование изображений (нужен пакет Pillow): вместо оригинала в Storage загружаются размеры
+# IMAGE_SIZES (имя:максимальная сторона в пикселях) в формате IMAGE_FORMAT (webp или jpeg).
+# Перекодирование идёт в пуле из IMAGE_TRANSCODE_PROCESSES процессов (0 - по числу ядер)
+IMAGE_TRANSCODE = os.getenv("IMAGE_TRANSCODE", "false").lower() in ("1", "true", "yes")
+IMAGE_SIZES = os.getenv("IMAGE_SIZES", "thumb:200,medium:800,full:1600")
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "webp").lower()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", 80))
+IMAGE_TRANSCODE_PROCESSES = int(os.getenv("IMAGE_TRANSCODE_PROCESSES", 0))
+
+# Лимиты API МойСклад: запросов за период (секунды), параллельных запросов,
+# повторы GET при 429/5xx и экспоненциальная задержка между ними (секунды)
+MS_RATE_LIMIT = int(os.getenv("MS_RATE_LIMIT", 45))
+MS_RATE_PERIOD = float(os.getenv("MS_RATE_PERIOD", 3))
+MS_MAX_CONCURRENT = int(os.getenv("MS_MAX_CONCURRENT", 5))
+MS_MAX_RETRIES = int(os.getenv("MS_MAX_RETRIES", 5))
+MS_BACKOFF_BASE = float(os.getenv("MS_BACKOFF_BASE", 0.5))
+MS_BACKOFF_MAX = float(os.getenv("MS_BACKOFF_MAX", 30))
+
+# Логирование: уровень, формат файла логов (text или json) и шаг выборки
+# для частых сообщений (в INFO попадает каждое N-е, остальные - в DEBUG)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", 100))
+
+# Сколько страниц стадия может скачать заранее, пока ждёт свои зависимости
+MS_PREFETCH_PAGES = int(os.getenv("MS_PREFETCH_PAGES", 4))
+
+# Вебхуки МойСклад: секрет в query-параметре token (без него вебхуки отключены), окно склейки событий (секунды) и размер пачки
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_COALESCE_SECONDS = float(os.getenv("WEBHOOK_COALESCE_SECONDS", 2))
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", 50))
+
+# Быстрое обновление остатков: период (секунды) и число параллельных UPDATE в Supabase
+STOCK_REFRESH_INTERVAL_SECONDS = int(os.getenv("STOCK_REFRESH_INTERVAL_SECONDS", 60))
+STOCK_WRITE_CONCURRENCY = int(os.getenv("STOCK_WRITE_CONCURRENCY", 8))
+# Сколько товаров/модификаций в одном фильтре отчёта об остатках: каждый - полный href,
+# длинный URL не пропускают прокси (ограничение строки запроса ~8 КБ)
+STOCK_FILTER_CHUNK_SIZE = int(os.getenv("STOCK_FILTER_CHUNK_SIZE", 40))
+
+# Кэш справочников (типы цен, склады): время жизни записи и предельный возраст,
+# после которого устаревший справочник не отдаётся даже на время фонового обновления (секунды)
+REFERENCE_TTL_SECONDS = int(os.getenv("REFERENCE_TTL_SECONDS", 3600))
+REFERENCE_MAX_STALE_SECONDS = int(os.getenv("REFERENCE_MAX_STALE_SECONDS", 86400))
+
+# Потоковый разбор страниц МойСклад (нужен пакет ijson): страница не собирается в памяти целиком,
+# строки отдаются пачками по MS_STREAM_CHUNK_ROWS. Страницы при этом читаются последовательно
+MS_STREAM_JSON = os.getenv("MS_STREAM_JSON", "false").lower() in ("1", "true", "yes")
+MS_STREAM_CHUNK_ROWS = int(os.getenv("MS_STREAM_CHUNK_ROWS", 100))
+
+# Сколько сводок последних прогонов синхронизации отдаёт GET /sync/runs
+METRICS_RUNS_KEEP = int(os.getenv("METRICS_RUNS_KEEP", 50))
+
+# API чтения каталога из снимка в памяти (GET /catalog/...) и максимальный размер страницы списка товаров
+CATALOG_CACHE_ENABLED = os.getenv("CATALOG_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CATALOG_MAX_PAGE_SIZE = int(os.getenv("CATALOG_MAX_PAGE_SIZE", 500))
+
+# Контрольные точки полной синхронизации: сколько секунд прерванный прогон можно продолжить,
+# а не начинать заново. Начальная синхронизация при старте пропускается, если последний
+# успешный полный прогон был не раньше SYNC_RECENT_SUCCESS_SECONDS назад
+SYNC_CHECKPOINT_MAX_AGE_SECONDS = int(os.getenv("SYNC_CHECKPOINT_MAX_AGE_SECONDS", 21600))
+SYNC_RECENT_SUCCESS_SECONDS = int(os.getenv("SYNC_RECENT_SUCCESS_SECONDS", 21600))
+
+# Распределённый режим: полную синхронизацию выполняют воркеры (python -m app.worker), разделы
+# раздаются через общий файл координации (относительный путь - внутри DATA_DIR). Аренды -
+# в секундах; SHARD_MAX_ATTEMPTS - попыток на раздел, SHARD_PARTITION_ROWS - строк в разделе
+SHARD_MODE = os.getenv("SHARD_MODE", "false").lower() in ("1", "true", "yes")
+SHARD_COORDINATOR_PATH = os.getenv("SHARD_COORDINATOR_PATH", "coordinator.sqlite")
+SHARD_LEASE_SECONDS = float(os.getenv("SHARD_LEASE_SECONDS", 30))
+SHARD_POLL_SECONDS = float(os.getenv("SHARD_POLL_SECONDS", 5))
+SHARD_MAX_ATTEMPTS = int(os.getenv("SHARD_MAX_ATTEMPTS", 3))
+SHARD_PARTITION_ROWS = int(os.getenv("SHARD_PARTITION_ROWS", 5000))
@@ -1,7 +1,35 @@
+import asyncio
+import functools
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from app.logger import logger
 
-scheduler = AsyncIOScheduler()
+# Задачи - корутины, выполняются в цикле событий приложения.
+# max_instances=1 и coalesce: пропущенные запуски одной задачи схлопываются в один,
+# а новый запуск не стартует, пока идёт предыдущий
+scheduler = AsyncIOScheduler(job_defaults={
+    "max_instances": 1,
+    "coalesce": True,
+    "misfire_grace_time": 60,
+})
+
+# Общая блокировка синхронизаций: разные задачи тоже не должны писать каталог одновременно
+sync_lock = asyncio.Lock()
+
+def exclusive(wait: bool):
+    """
+    Запускает задачу под sync_lock. wait=True - дождаться окончания текущей
+    синхронизации, wait=False - пропустить запуск, если синхронизация уже идёт.
+    """
+    def decorator(job):
+        @functools.wraps(job)
+        async def wrapper(*args, **kwargs):
+            if not wait and sync_lock.locked():
+                logger.info(f"{job.__name__}: синхронизация уже выполняется, запуск пропущен")
+                return None
+            async with sync_lock:
+                return await job(*args, **kwargs)
+        return wrapper
+    return decorator
 
 def start_scheduler():
     scheduler.start()
@@ -0,0 +1,11 @@
+import os
+import sqlite3
+from app.core import config
+
+def connect(name: str) -> sqlite3.Connection:
+    """Открывает локальную SQLite-базу в DATA_DIR (кэши и служебное состояние процесса)"""
+    os.makedirs(config.DATA_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(config.DATA_DIR, name), check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
@@ -0,0 +1,20 @@
+import asyncio
+from app.db.supabase_client import supabase
+
+# Размер страницы при чтении таблиц из Supabase (ограничение PostgREST по умолчанию)
+PAGE_SIZE = 1000
+
+async def iter_table_pages(table: str, columns: str = "*"):
+    """
+    Постранично читает всю таблицу (упорядоченно по id, диапазонами по
+    PAGE_SIZE строк) и отдаёт страницы списками строк.
+    """
+    start = 0
+    while True:
+        query = supabase.table(table).select(columns).order("id").range(start, start + PAGE_SIZE - 1)
+        # Клиент Supabase синхронный: выносим запрос из цикла событий
+        result = await asyncio.to_thread(query.execute)
+        yield result.data
+        if len(result.data) < PAGE_SIZE:
+            return
+        start += PAGE_SIZE
@@ -0,0 +1,248 @@
+import asyncio
+import random
+import time
+from app.core import config
+from app.db.supabase_client import supabase
+from app.logger import logger
+from app.services.metrics import metrics
+
+# Классы SQLSTATE, означающие ошибку в самих данных: повтор той же пачки не поможет
+_DATA_SQLSTATE_CLASSES = ("22", "23", "42")
+
+def is_data_error(exc: Exception) -> bool:
+    """
+    Ошибка в данных пачки (4xx PostgREST: нарушение ограничений, неверный тип
+    и т.п.), а не временный сбой. Код - из APIError postgrest: SQLSTATE, PGRST...
+    или HTTP-статус, если тело ответа не JSON. Ошибки без кода (таймауты,
+    обрывы соединения) считаются временными.
+    """
+    code = str(getattr(exc, "code", None) or "")
+    if code.startswith("PGRST"):
+        return True
+    if code.isdigit() and len(code) == 3:
+        return code.startswith("4") and code not in ("408", "429")
+    return len(code) == 5 and code[:2] in _DATA_SQLSTATE_CLASSES
+
+class BatchWriter:
+    """
+    Буфер записи в Supabase: копит строки и отправляет их одним upsert'ом
+    списком, когда набирается batch_size строк или проходит flush_interval
+    секунд с прошлой отправки. Временные ошибки (таймауты, 5xx) повторяются
+    с экспоненциальной задержкой. Если пачку отклонили из-за данных (4xx
+    PostgREST), она делится пополам и отправляется повторно, так что одна
+    плохая строка не теряет остальные.
+    """
+
+    def __init__(self, table: str, batch_size: int = None, flush_interval: float = None,
+                 on_commit=None, fingerprints=None, on_checkpoint=None):
+        self.table = table
+        self.batch_size = batch_size or config.SUPABASE_BATCH_SIZE
+        self.flush_interval = flush_interval if flush_interval is not None else config.SUPABASE_FLUSH_INTERVAL
+        # Вызываются со списком строк после их успешной записи (одна функция или список);
+        # для правок (patch) - со строками из id и изменённых полей
+        if on_commit is None:
+            self.on_commit = []
+        elif callable(on_commit):
+            self.on_commit = [on_commit]
+        else:
+            self.on_commit = list(on_commit)
+        # Хранилище отпечатков строк (FingerprintStore): неизменённые строки не отправляются
+        self.fingerprints = fingerprints
+        # Вызывается с позицией в источнике, все строки до которой уже записаны (см. mark)
+        self.on_checkpoint = on_checkpoint
+        self._mark = None
+        self._saved_mark = None
+        # После потерянных строк позиция дальше не двигается: продолжение прогона должно их перечитать
+        self._mark_blocked = False
+        # Ключ - id строки: повтор одного id в пачке PostgREST не принимает
+        self._buffer = {}
+        # Правки уже отправленных строк: применяются после ближайшей записи пачки
+        self._patches = {}
+        self._last_flush = time.monotonic()
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.patched = 0
+        self.skipped = 0
+        self._write_time = 0.0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is asyncio.CancelledError:
+            # Отмена (например, воркер потерял аренду раздела): буфер не пишем, его перечитает следующий проход
+            logger.warning(f"[{self.table}] Запись отменена, не отправлено {len(self._buffer)} строк")
+            self._buffer = {}
+            self._patches = {}
+            return
+        await self.close()
+
+    async def add(self, row: dict):
+        metrics.rows.inc(self.table, "processed")
+        if self.fingerprints is not None and self.fingerprints.is_unchanged(self.table, row):
+            self.skipped += 1
+            metrics.rows.inc(self.table, "skipped")
+            return
+        self._buffer[row["id"]] = row
+        if (len(self._buffer) >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            await self.flush()
+
+    def patch(self, row_id, fields: dict):
+        """
+        Дописывает поля в строку. Если строка ещё в буфере, правка попадёт в
+        тот же upsert; иначе она применяется UPDATE'ом после ближайшей записи
+        пачки, т.е. гарантированно после вставки самой строки.
+        """
+        if row_id in self._buffer:
+            self._buffer[row_id].update(fields)
+            return
+        if self.fingerprints is not None and row_id not in self._patches:
+            # Строка была пропущена как неизменённая или уже записана - её отпечаток больше не верен
+            self.fingerprints.forget(self.table, [row_id])
+        self._patches.setdefault(row_id, {}).update(fields)
+
+    def mark(self, position: int):
+        """
+        Отмечает, что все строки источника до position уже переданы в add().
+        Когда они записаны, позиция уходит в on_checkpoint - с неё можно
+        продолжить прерванный прогон.
+        """
+        if self.on_checkpoint is None:
+            return
+        self._mark = position
+        if not self._buffer and not self._patches:
+            # Ждать нечего (например, все строки без изменений) - позиция уже надёжна
+            self._save_mark(position)
+
+    def hold_marks(self):
+        """
+        Позиция больше не сохраняется: строки, переданные после последней
+        сохранённой позиции, при продолжении прогона нужно прочитать заново.
+        """
+        self._mark_blocked = True
+
+    def _save_mark(self, position):
+        if position is None or position == self._saved_mark or self._mark_blocked:
+            return
+        try:
+            self.on_checkpoint(position)
+            self._saved_mark = position
+        except Exception as e:
+            logger.error(f"[{self.table}] Не удалось сохранить контрольную точку: {str(e)}")
+
+    async def flush(self):
+        self._last_flush = time.monotonic()
+        # Позицию берём до записи: строки, добавленные во время записи, в эту пачку не попали
+        mark = self._mark
+        if self._buffer:
+            rows = list(self._buffer.values())
+            self._buffer = {}
+
+            started = time.monotonic()
+            failed = self.failed
+            # PostgREST берёт колонки upsert по первой строке: строки с другим набором полей
+            # (например, без stock) отправляются отдельно, иначе недостающие поля обнулятся
+            groups = {}
+            for row in rows:
+                groups.setdefault(frozenset(row), []).append(row)
+            for group in groups.values():
+                await self._upsert(group)
+            self._write_time += time.monotonic() - started
+            if self.failed > failed:
+                self._mark_blocked = True
+        await self._apply_patches()
+        if self.on_checkpoint is not None:
+            self._save_mark(mark)
+
+    async def _apply_patches(self):
+        patches, self._patches = self._patches, {}
+        for row_id, fields in patches.items():
+            try:
+                # Клиент Supabase синхронный: выносим запрос из цикла событий
+                result = await asyncio.to_thread(supabase.table(self.table).update(fields).eq("id", row_id).execute)
+                if not result.data:
+                    # Строка так и не записалась (upsert не прошёл) - правка ни к чему не применилась
+                    logger.warning(f"[{self.table}] Правка строки {row_id} не применена: строки нет в базе")
+                    continue
+                self.patched += 1
+                metrics.rows.inc(self.table, "patched")
+                for callback in self.on_commit:
+                    callback([{"id": row_id, **fields}])
+            except Exception as e:
+                logger.error(f"[{self.table}] Не удалось обновить строку {row_id}: {str(e)}")
+
+    async def _execute_upsert(self, rows: list):
+        """Один upsert с повторами при временных ошибках; ошибка данных или исчерпанные повторы - наружу"""
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                await asyncio.to_thread(supabase.table(self.table).upsert(rows).execute)
+                metrics.supabase_latency.observe(time.monotonic() - started, self.table, "ok")
+                return
+            except Exception as e:
+                metrics.supabase_latency.observe(time.monotonic() - started, self.table, "error")
+                if is_data_error(e) or attempt >= config.SUPABASE_WRITE_RETRIES:
+                    raise
+                delay = min(config.SUPABASE_BACKOFF_MAX, config.SUPABASE_BACKOFF_BASE * (2 ** attempt))
+                delay *= random.uniform(0.5, 1.5)
+                attempt += 1
+                logger.warning(
+                    f"[{self.table}] Временная ошибка записи пачки из {len(rows)} строк, "
+                    f"повтор {attempt} через {delay:.1f} с: {str(e)}"
+                )
+                await asyncio.sleep(delay)
+
+    def _fail(self, rows: list, error: Exception):
+        self.failed += len(rows)
+        metrics.rows.inc(self.table, "failed", amount=len(rows))
+        if len(rows) == 1:
+            logger.error(f"[{self.table}] Не удалось записать строку {rows[0].get('id')}: {str(error)}")
+        else:
+            logger.error(f"[{self.table}] Не удалось записать пачку из {len(rows)} строк: {str(error)}")
+
+    async def _upsert(self, rows: list):
+        try:
+            await self._execute_upsert(rows)
+        except Exception as e:
+            if len(rows) == 1 or not is_data_error(e):
+                # Временный сбой не лечится делением пачки: строки теряются, прогон считается неудачным
+                self._fail(rows, e)
+                return
+            # Делим пачку, чтобы найти и отбросить только проблемные строки
+            logger.warning(f"[{self.table}] Пачка из {len(rows)} строк отклонена, делим: {str(e)}")
+            middle = len(rows) // 2
+            await self._upsert(rows[:middle])
+            await self._upsert(rows[middle:])
+            return
+
+        metrics.rows.inc(self.table, "written", amount=len(rows))
+        self.written += len(rows)
+        self.batches += 1
+        if self.fingerprints is not None:
+            await asyncio.to_thread(self.fingerprints.record, self.table, rows)
+        for callback in self.on_commit:
+            callback(rows)
+
+    def report(self) -> dict:
+        rate = self.written / self._write_time if self._write_time > 0 else 0.0
+        return {
+            "table": self.table,
+            "written": self.written,
+            "failed": self.failed,
+            "batches": self.batches,
+            "patched": self.patched,
+            "skipped": self.skipped,
+            "seconds": round(self._write_time, 3),
+            "rows_per_second": round(rate, 1),
+        }
+
+    async def close(self):
+        await self.flush()
+        stats = self.report()
+        logger.info(
+            f"[{self.table}] Записано {stats['written']} строк ({stats['batches']} пачек), "
+            f"без изменений {stats['skipped']}, ошибок {stats['failed']}, {stats['rows_per_second']} строк/с"
+        )
@@ -1,3 +1,32 @@
+import sys
+from collections import defaultdict
 from loguru import logger
+from app.core import config
 
-logger.add("logs/app.log", rotation="1 day", retention="7 days")
+logger.remove()
+logger.add(sys.stderr, level=config.LOG_LEVEL)
+# enqueue=True: форматирование и запись в файл идут в отдельном потоке, а не в цикле событий.
+# В режиме json каждая запись - одна строка JSON со всеми полями из bind()
+logger.add(
+    "logs/app.log",
+    rotation="1 day",
+    retention="7 days",
+    level=config.LOG_LEVEL,
+    enqueue=True,
+    serialize=config.LOG_FORMAT == "json",
+)
+
+# Счётчики для выборочного логирования по категориям
+_sample_counters = defaultdict(int)
+
+def log_sampled(category: str, message: str, *args, every: int = None, **fields):
+    """
+    Пишет в INFO только каждое every-е сообщение категории (первое - всегда),
+    остальные уходят в DEBUG. Сообщение форматируется loguru только если
+    уровень реально пишется; fields попадают в структурированную запись.
+    """
+    every = every or config.LOG_SAMPLE_EVERY
+    count = _sample_counters[category]
+    _sample_counters[category] = count + 1
+    level = "INFO" if count % every == 0 else "DEBUG"
+    logger.bind(category=category, **fields).opt(depth=1).log(level, message, *args)
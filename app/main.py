@@ -1,145 +1,282 @@
 from fastapi import FastAPI
 from app.api import routes
-from app.core.scheduler import scheduler, start_scheduler
-from app.services import categories, products, modifications
+from app.core.scheduler import scheduler, start_scheduler, exclusive
+from app.services import categories, products, modifications, stock
+from app.services import http_client, sync_state, transcode, webhooks
+from app.services.rate_limiter import rate_limiter
+from app.services.metrics import metrics
+from app.services.catalog import catalog_cache
+from app.services.checkpoints import checkpoint_store
+from app.services.coordinator import get_coordinator, leader_only
+from app.services.sharding import run_sharded_full_sync
+from app.services.pagination import PrefetchedRows
+from app.services.stage_graph import StageGraph
+from app.services.product_index import product_ids
+from app.services.reference import reference_cache
 from app.core import config
 from app.db.supabase_client import supabase
 from app.logger import logger
 import asyncio
 import time
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-import httpx
-from app.services.utils import get_headers, log_response_details
 
-app = FastAPI()
-app.include_router(routes.router)
-
-# Обертки для асинхронных функций
-def run_sync_categories():
-    # Создаем новый цикл событий
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+# Обертки для асинхронных функций: выполняются прямо в цикле событий приложения,
+# чтобы использовать общий HTTP-клиент
+async def run_sync_categories(updated_since: str = None) -> bool:
     try:
-        # Запускаем асинхронную функцию в этом цикле
-        loop.run_until_complete(categories.sync_categories())
+        return await categories.sync_categories(updated_since)
     except Exception as e:
         logger.error(f"Ошибка в планировщике категорий: {str(e)}")
-    finally:
-        # Закрываем цикл событий
-        loop.close()
+        return False
 
-def run_sync_products(stores: dict):
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+async def run_load_stores(refresh: bool = False):
     try:
-        loop.run_until_complete(products.sync_products(stores))
+        if refresh:
+            # Полная сверка заодно перечитывает справочник складов
+            return await reference_cache.refresh("stores")
+        return await reference_cache.get("stores")
+    except Exception as e:
+        # Продолжаем без складов: остатки получат названия складов из самого отчёта
+        logger.error(f"[Full Sync] Ошибка при загрузке складов: {str(e)}")
+        return {}
+
+async def run_sync_products(stores: dict, stock_index: dict = None, updated_since: str = None,
+                            **kwargs) -> bool:
+    try:
+        return await products.sync_products(stores, stock_index, updated_since, **kwargs)
     except Exception as e:
         logger.error(f"Ошибка в планировщике товаров: {str(e)}")
-    finally:
-        loop.close()
+        return False
 
-def run_sync_modifications(stores: dict):
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+async def run_sync_modifications(stores: dict, stock_index: dict = None, updated_since: str = None,
+                                 **kwargs) -> bool:
     try:
-        loop.run_until_complete(modifications.sync_modifications(stores))
+        return await modifications.sync_modifications(stores, stock_index, updated_since, **kwargs)
     except Exception as e:
         logger.error(f"Ошибка в планировщике модификаций: {str(e)}")
-    finally:
-        loop.close()
+        return False
 
-def run_full_sync():
-    """Запускаем полную синхронизацию последовательно"""
-    logger.info("Запуск полной синхронизации")
-    
-    # Загружаем склады один раз
-    stores = {}
+async def save_watermark(entity: str, watermark: str, success: bool):
+    # Отметку двигаем только после успешного прохода, иначе изменения потеряются
+    if not success:
+        logger.warning(f"Синхронизация {entity} завершилась с ошибкой, отметка не обновлена")
+        return
     try:
-        headers = get_headers()
-        if headers:
-            stores_url = f"{config.MS_BASE_URL}/entity/store"
-            logger.info(f"[Full Sync] Запрашиваем склады: {stores_url}")
-            store_response = httpx.get(stores_url, headers=headers)
-            log_response_details(store_response, stores_url)
-            store_response.raise_for_status()
-            
-            # Логируем полный ответ для складов
-            stores_json = store_response.json()
-            logger.debug(f"[Full Sync] JSON ответа для складов: {stores_json}")
-            
-            # Обрабатываем первую страницу
-            current_stores = {s["id"]: s["name"] for s in stores_json.get("rows", [])}
-            stores.update(current_stores)
-            
-            # TODO: Обработка пагинации для складов (если есть nextHref)
-            # next_href = stores_json.get("meta", {}).get("nextHref")
-            # while next_href:
-            #    logger.info(f"[Full Sync] Запрашиваем следующую страницу складов: {next_href}")
-            #    store_response = httpx.get(next_href, headers=headers)
-            #    log_response_details(store_response, next_href)
-            #    store_response.raise_for_status()
-            #    stores_json = store_response.json()
-            #    logger.debug(f"[Full Sync] JSON ответа для складов (страница): {stores_json}")
-            #    current_stores = {s["id"]: s["name"] for s in stores_json.get("rows", [])}
-            #    stores.update(current_stores)
-            #    next_href = stores_json.get("meta", {}).get("nextHref")
-
-            logger.info(f"[Full Sync] Получено {len(stores)} складов (после обработки ответа)")
-        else:
-            logger.error("[Full Sync] Не удалось получить заголовки для запроса складов.")
+        await sync_state.set_watermark(entity, watermark)
     except Exception as e:
-        logger.error(f"[Full Sync] Ошибка при загрузке складов: {str(e)}")
-        # TODO: Решить, стоит ли продолжать без складов или прервать
-        # Пока что продолжаем, но остатки не будут правильно обработаны
-
-    # Запускаем синхронизацию категорий (склады не нужны)
-    run_sync_categories()
-    time.sleep(2)
-    
-    # Передаем загруженные склады в синхронизацию товаров и модификаций
-    run_sync_products(stores)
-    time.sleep(2)
-    run_sync_modifications(stores)
-    
+        logger.error(f"Не удалось сохранить отметку синхронизации {entity}: {str(e)}")
+
+async def run_full_sync():
+    if config.SHARD_MODE:
+        # Строки пишут воркеры (python -m app.worker), здесь - только план и ожидание.
+        # sync_lock не берём: пока воркеры работают, лидер обновляет остатки и делает инкрементальные прогоны
+        started_at = time.time()
+        report = await run_sharded_full_sync()
+        metrics.record_run("full", started_at, report["status"], report)
+        catalog_cache.request_rebuild()
+        return report
+    return await run_local_full_sync()
+
+@exclusive(wait=True)
+async def run_local_full_sync():
+    """
+    Полная синхронизация (периодическая сверка всего каталога) как граф стадий.
+    Порядок нужен только по внешним ключам: категории раньше товаров, товар
+    раньше своих модификаций. Склады, категории и остатки грузятся параллельно,
+    страницы товаров и модификаций начинают качаться сразу, а модификации
+    пишутся, как только известен их товар. Прерванный прогон продолжается
+    с контрольных точек: завершённые сущности пропускаются, товары и
+    модификации читаются с последней записанной пачки.
+    """
+    logger.info("Запуск полной синхронизации")
+    started_at = time.time()
+    # Полный проход покрывает всё, что изменилось до его начала (для продолженного - до начала первой попытки)
+    run = checkpoint_store.begin("full", sync_state.now_watermark())
+    run_id, watermark = run["run_id"], run["watermark"]
+    positions = run["positions"]
+
+    def resume_offset(entity: str) -> int:
+        return positions.get(entity, (0, False))[0]
+
+    def is_done(entity: str) -> bool:
+        return positions.get(entity, (0, False))[1]
+
+    def checkpoint(entity: str):
+        return lambda position: checkpoint_store.save(run_id, entity, position)
+
+    graph = StageGraph("Full Sync")
+    product_rows = None if is_done("products") else PrefetchedRows(
+        f"{config.MS_BASE_URL}/entity/product", start_offset=resume_offset("products")
+    )
+    variant_rows = None if is_done("modifications") else PrefetchedRows(
+        f"{config.MS_BASE_URL}/entity/variant", start_offset=resume_offset("modifications")
+    )
+
+    async def stage_stores(results):
+        return await run_load_stores(refresh=True)
+
+    async def stage_price_types(results):
+        return await reference_cache.refresh("price_types")
+
+    async def stage_categories(results):
+        if is_done("categories"):
+            return
+        success = await run_sync_categories()
+        await save_watermark("categories", watermark, success)
+        if not success:
+            raise RuntimeError("категории не синхронизированы")
+        checkpoint_store.save(run_id, "categories", 0, done=True)
+
+    async def stage_stock(results):
+        # Один снимок остатков на весь прогон, общий для товаров и модификаций
+        return await stock.try_load_stock_index(results["stores"])
+
+    async def stage_products(results):
+        if is_done("products"):
+            return
+        success = await run_sync_products(
+            results["stores"], results["stock"], rows=product_rows,
+            start_offset=resume_offset("products"), on_checkpoint=checkpoint("products"),
+        )
+        await save_watermark("products", watermark, success)
+        if not success:
+            raise RuntimeError("товары не синхронизированы")
+        checkpoint_store.save(run_id, "products", 0, done=True)
+        # Только полный проход с начала даёт полный индекс товаров
+        if not resume_offset("products"):
+            product_ids.mark_loaded()
+
+    async def stage_modifications(results):
+        if is_done("modifications"):
+            return
+        success = await run_sync_modifications(
+            results["stores"], results["stock"], rows=variant_rows,
+            products_done=graph.done_event("products"),
+            products_ok=lambda: graph.report.get("products", {}).get("status") == "ok",
+            start_offset=resume_offset("modifications"), on_checkpoint=checkpoint("modifications"),
+        )
+        await save_watermark("modifications", watermark, success)
+        if not success:
+            raise RuntimeError("модификации не синхронизированы")
+        checkpoint_store.save(run_id, "modifications", 0, done=True)
+
+    graph.add("stores", stage_stores)
+    graph.add("categories", stage_categories)
+    graph.add("stock", stage_stock, deps=["stores"])
+    graph.add("price_types", stage_price_types)
+    graph.add("products", stage_products, deps=["categories", "stock", "price_types"])
+    graph.add("modifications", stage_modifications, deps=["stock"])
+
+    try:
+        report = await graph.run()
+    finally:
+        # Если стадия не стартовала, её фоновая загрузка страниц больше не нужна
+        for rows in (product_rows, variant_rows):
+            if rows is not None:
+                rows.cancel()
+
+    rate_limiter.log_stats()
+    status = "ok" if all(entry["status"] == "ok" for entry in report["stages"].values()) else "failed"
+    if status == "ok":
+        checkpoint_store.finish(run_id)
+    else:
+        # Контрольные точки остаются: следующий полный прогон продолжит с них
+        logger.warning(f"Полная синхронизация {run_id} завершилась с ошибками, её можно будет продолжить")
+    report["run_id"] = run_id
+    report["resumed"] = run["resumed"]
+    metrics.record_run("full", started_at, status, report)
+    catalog_cache.request_rebuild()
     logger.info("Полная синхронизация завершена")
+    return report
+
+@exclusive(wait=False)
+async def run_incremental_sync():
+    """Инкрементальная синхронизация: только строки, изменённые после сохранённых отметок"""
+    watermarks = {}
+    for entity in ("categories", "products", "modifications"):
+        try:
+            watermarks[entity] = await sync_state.get_watermark(entity)
+        except Exception as e:
+            logger.error(f"Не удалось прочитать отметку синхронизации {entity}: {str(e)}")
+            return
+
+    if not all(watermarks.values()):
+        # Без отметок инкрементальный режим невозможен - ждём полной синхронизации
+        logger.info("Отметки синхронизации ещё не сохранены, инкрементальный прогон пропущен")
+        return
+
+    logger.info(f"Запуск инкрементальной синхронизации: {watermarks}")
+    started_at = time.time()
+    watermark = sync_state.now_watermark()
+    stores = await run_load_stores()
+
+    results = {}
+    results["categories"] = await run_sync_categories(watermarks["categories"])
+    results["products"] = await run_sync_products(stores, None, watermarks["products"])
+    results["modifications"] = await run_sync_modifications(
+        stores, None, watermarks["modifications"], products_ok=lambda: results["products"],
+    )
+    for entity, success in results.items():
+        await save_watermark(entity, watermark, success)
+    metrics.record_run(
+        "incremental", started_at, "ok" if all(results.values()) else "failed",
+        {"since": watermarks, "entities": results},
+    )
+    catalog_cache.request_update()
+
+    logger.info("Инкрементальная синхронизация завершена")
 
-@app.on_event("startup")
 async def startup_event():
     logger.info("Запуск планировщика и приложения")
     start_scheduler()
 
-    # Запускаем немедленную полную синхронизацию через 3 секунды после старта
-    # Эта функция теперь загрузит склады и передаст их дальше
-    scheduler.add_job(run_full_sync, trigger='date', 
-                     run_date=datetime.now() + timedelta(seconds=3), 
-                     id="initial_sync")
-
-    # --- Планирование интервальной синхронизации --- 
-    # ПРИМЕЧАНИЕ: Интервальная синхронизация теперь будет сложнее,
-    # т.к. нужно передавать актуальные склады.
-    # Пока что оставим старую логику для интервалов, но она не будет 
-    # корректно работать с остатками, если склады изменятся.
-    # TODO: Переделать интервальную синхронизацию для передачи складов.
-    
-    # Сначала синхронизируем категории
-    scheduler.add_job(run_sync_categories, "interval", seconds=config.SYNC_INTERVAL_SECONDS, id="categories_sync")
-    
-    # Создаем обертки для интервальных задач БЕЗ передачи складов (временно)
-    def run_interval_sync_products():
-        run_sync_products({}) # Передаем пустой словарь
-        
-    def run_interval_sync_modifications():
-        run_sync_modifications({}) # Передаем пустой словарь
-
-    # Затем запускаем синхронизацию товаров с задержкой (ВРЕМЕННО ОТКЛЮЧЕНО)
-    # scheduler.add_job(run_interval_sync_products, "interval", seconds=config.SYNC_INTERVAL_SECONDS, 
-    #                  start_date=datetime.now() + timedelta(seconds=10), id="products_sync")
-    
-    # Затем запускаем синхронизацию модификаций с задержкой (ВРЕМЕННО ОТКЛЮЧЕНО)
-    # scheduler.add_job(run_interval_sync_modifications, "interval", seconds=config.SYNC_INTERVAL_SECONDS,
-    #                  start_date=datetime.now() + timedelta(seconds=20), id="modifications_sync")
-
-    supabase.table("sync_status").upsert({"id": 1, "last_sync": "now()"}).execute()
+    # Полная синхронизация через 3 секунды после старта - только если она действительно нужна:
+    # недавний успешный прогон не повторяем, прерванный - продолжаем с контрольной точки
+    last_success = checkpoint_store.last_success("full")
+    recent = last_success is not None and time.time() - last_success < config.SYNC_RECENT_SUCCESS_SECONDS
+    if recent and not checkpoint_store.resumable("full"):
+        logger.info(f"Полная синхронизация была {int(time.time() - last_success)} с назад, начальный прогон пропущен")
+    else:
+        scheduler.add_job(leader_only(run_full_sync), trigger='date', 
+                         run_date=datetime.now() + timedelta(seconds=3), 
+                         id="initial_sync")
+
+    # Полная сверка каталога - редко, изменения между сверками подхватывает инкрементальный прогон
+    scheduler.add_job(leader_only(run_full_sync), "interval", seconds=config.FULL_SYNC_INTERVAL_SECONDS, id="full_sync")
+
+    # Инкрементальная синхронизация категорий, товаров и модификаций по отметкам updated
+    scheduler.add_job(leader_only(run_incremental_sync), "interval", seconds=config.SYNC_INTERVAL_SECONDS, id="incremental_sync")
+
+    # Частое обновление только остатков, без изображений и остальных полей
+    scheduler.add_job(leader_only(stock.refresh_stock), "interval", seconds=config.STOCK_REFRESH_INTERVAL_SECONDS, id="stock_refresh")
+
+    await asyncio.to_thread(supabase.table("sync_status").upsert({"id": 1, "last_sync": "now()"}).execute)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Общий HTTP-клиент живёт столько же, сколько приложение
+    await http_client.start_client()
+    if config.SHARD_MODE:
+        # Из нескольких реплик задачи планировщика выполняет только держатель аренды "scheduler"
+        get_coordinator().start_leadership()
+    await startup_event()
+    webhooks.webhook_queue.start()
+    # Снимок каталога для API чтения - из того, что уже лежит в Supabase
+    catalog_cache.request_rebuild()
+    try:
+        yield
+    finally:
+        await webhooks.webhook_queue.stop()
+        if config.SHARD_MODE:
+            await get_coordinator().stop_leadership()
+        scheduler.shutdown(wait=False)
+        await http_client.close_client()
+        # Пул перекодирования изображений: процессы не переживают приложение
+        await asyncio.to_thread(transcode.shutdown)
+
+app = FastAPI(lifespan=lifespan)
+app.include_router(routes.router)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,239 @@
+import asyncio
+import hashlib
+from app.core import config
+from app.db.reader import iter_table_pages
+from app.logger import logger
+from app.services import json_stream
+
+# Поля товара в компактной выдаче списка
+COMPACT_FIELDS = ("id", "name", "image_url", "image_variants", "prices")
+
+class CatalogSnapshot:
+    """
+    Неизменяемый снимок каталога для API чтения: строки таблиц и индексы
+    родитель -> дети и категория -> товары. Версия - хэш содержимого,
+    поэтому пересборка без изменений не сбрасывает ETag у клиентов.
+    """
+
+    __slots__ = ("version", "categories", "children", "products", "by_category", "modifications", "variants", "_tree")
+
+    def __init__(self, version: str, categories: list, products: list, variants: list):
+        self.version = version
+        self.categories = {row["id"]: row for row in categories}
+        self.children = {}
+        for row in sorted(categories, key=lambda r: r.get("name") or ""):
+            parent_id = row.get("parent_id")
+            # Родитель не синхронизирован - показываем категорию в корне
+            if parent_id not in self.categories:
+                parent_id = None
+            self.children.setdefault(parent_id, []).append(row["id"])
+        self.products = {row["id"]: row for row in products}
+        self.by_category = {}
+        for row in sorted(products, key=lambda r: r.get("name") or ""):
+            self.by_category.setdefault(row.get("category_id"), []).append(row["id"])
+        self.modifications = {row["id"]: row for row in variants}
+        self.variants = {}
+        for row in sorted(variants, key=lambda r: r.get("name") or ""):
+            self.variants.setdefault(row.get("product_id"), []).append(row)
+        self._tree = None
+
+    def category_tree(self) -> list:
+        # Дерево одинаково для всех запросов - строим один раз на снимок
+        if self._tree is None:
+            def build(parent_id):
+                return [
+                    {"id": cat_id, "name": self.categories[cat_id]["name"], "children": build(cat_id)}
+                    for cat_id in self.children.get(parent_id, [])
+                ]
+            self._tree = build(None)
+        return self._tree
+
+    def category_products(self, category_id: str, offset: int, limit: int, compact: bool) -> dict:
+        ids = self.by_category.get(category_id, [])
+        items = [self.products[product_id] for product_id in ids[offset:offset + limit]]
+        if compact:
+            items = [{field: item.get(field) for field in COMPACT_FIELDS} for item in items]
+        return {"total": len(ids), "offset": offset, "limit": limit, "items": items}
+
+    def product(self, product_id: str) -> dict:
+        row = self.products.get(product_id)
+        if row is None:
+            return None
+        return {**row, "variants": self.variants.get(product_id, [])}
+
+    def apply(self, changes: dict, deleted: dict) -> "CatalogSnapshot":
+        """
+        Новый снимок с применёнными изменениями без чтения базы: changes -
+        {таблица: {ID: записанные поля}}, deleted - {таблица: множество ID}.
+        Строки без изменений общие со старым снимком. Удаления повторяют
+        то, что делает с базой обработка вебхуков: вместе с товаром уходят
+        его модификации, у товаров удалённой категории category_id обнуляется.
+        """
+        tables = {
+            "categories": dict(self.categories),
+            "products": dict(self.products),
+            "modifications": dict(self.modifications),
+        }
+        for table, ids in deleted.items():
+            for row_id in ids:
+                tables[table].pop(row_id, None)
+        removed_products = deleted.get("products", ())
+        removed_categories = deleted.get("categories", ())
+        if removed_products:
+            tables["modifications"] = {
+                row_id: row for row_id, row in tables["modifications"].items()
+                if row.get("product_id") not in removed_products
+            }
+        if removed_categories:
+            for row_id, row in tables["products"].items():
+                if row.get("category_id") in removed_categories:
+                    tables["products"][row_id] = {**row, "category_id": None}
+        for table, rows in changes.items():
+            for row_id, fields in rows.items():
+                tables[table][row_id] = {**tables[table].get(row_id, {}), **fields}
+
+        # Версия - от прежней и самих изменений: одинаковые изменения дают одинаковый ETag
+        digest = hashlib.blake2b(self.version.encode(), digest_size=8)
+        digest.update(json_stream.dumps([changes, {table: sorted(ids) for table, ids in deleted.items()}]))
+        return CatalogSnapshot(
+            digest.hexdigest(),
+            list(tables["categories"].values()),
+            list(tables["products"].values()),
+            list(tables["modifications"].values()),
+        )
+
+class CatalogCache:
+    """
+    Каталог для API чтения в памяти процесса. Целиком из Supabase
+    пересобирается только при старте и после полной синхронизации; строки,
+    записанные инкрементальными прогонами, вебхуками и обновлением остатков,
+    копятся (record/forget) и применяются к снимку без чтения базы
+    (request_update). Снимок подменяется одной операцией присваивания, так
+    что чтение никогда не видит полусобранный. Запросы во время идущей
+    пересборки склеиваются.
+    """
+
+    TABLES = ("categories", "products", "modifications")
+
+    def __init__(self):
+        self.snapshot = None
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._full_pending = False
+        self._update_pending = False
+        # Записанные, но ещё не применённые к снимку изменения
+        self._changes = {table: {} for table in self.TABLES}
+        self._deleted = {table: set() for table in self.TABLES}
+
+    def _tracking(self) -> bool:
+        # Пока снимка нет и он не строится, копить изменения незачем (например, в воркере SHARD_MODE)
+        if not config.CATALOG_CACHE_ENABLED:
+            return False
+        return self.snapshot is not None or (self._task is not None and not self._task.done())
+
+    def record(self, table: str, rows: list):
+        """Запоминает записанные в Supabase строки (полные или только изменённые поля)"""
+        if not self._tracking():
+            return
+        changes, deleted = self._changes[table], self._deleted[table]
+        for row in rows:
+            changes.setdefault(row["id"], {}).update(row)
+            deleted.discard(row["id"])
+
+    def observer(self, table: str):
+        # on_commit для BatchWriter
+        return lambda rows: self.record(table, rows)
+
+    def forget(self, table: str, ids: list):
+        """Запоминает удалённые из Supabase строки"""
+        if not self._tracking():
+            return
+        for row_id in ids:
+            self._changes[table].pop(row_id, None)
+            self._deleted[table].add(row_id)
+
+    def _take_changes(self) -> tuple:
+        changes = {table: rows for table, rows in self._changes.items() if rows}
+        deleted = {table: ids for table, ids in self._deleted.items() if ids}
+        self._changes = {table: {} for table in self.TABLES}
+        self._deleted = {table: set() for table in self.TABLES}
+        return changes, deleted
+
+    async def _load_table(self, table: str, digest) -> list:
+        rows = []
+        async for page in iter_table_pages(table):
+            rows.extend(page)
+            digest.update(json_stream.dumps(page))
+        return rows
+
+    async def rebuild(self) -> CatalogSnapshot:
+        async with self._lock:
+            # Изменения, записанные до начала чтения, в него попадут; записанные во время - применятся после
+            self._take_changes()
+            digest = hashlib.blake2b(digest_size=8)
+            categories, products, variants = [await self._load_table(table, digest) for table in self.TABLES]
+            version = digest.hexdigest()
+            if self.snapshot is not None and self.snapshot.version == version:
+                logger.info("Каталог для API не изменился")
+                return self.snapshot
+            # Индексы строим в потоке: на больших каталогах это заметная CPU-работа
+            snapshot = await asyncio.to_thread(CatalogSnapshot, version, categories, products, variants)
+            self.snapshot = snapshot
+            logger.info(
+                f"Каталог для API пересобран (версия {version}): категорий {len(categories)}, "
+                f"товаров {len(products)}, модификаций {len(variants)}"
+            )
+            return snapshot
+
+    async def apply_changes(self) -> CatalogSnapshot:
+        async with self._lock:
+            changes, deleted = self._take_changes()
+            if self.snapshot is None or not (changes or deleted):
+                return self.snapshot
+            snapshot = await asyncio.to_thread(self.snapshot.apply, changes, deleted)
+            self.snapshot = snapshot
+            logger.info(
+                f"Каталог для API обновлён (версия {snapshot.version}): "
+                f"изменено {sum(map(len, changes.values()))}, удалено {sum(map(len, deleted.values()))} строк"
+            )
+            return snapshot
+
+    def request_rebuild(self):
+        """Полная пересборка из Supabase в фоне (после полной синхронизации и при старте)"""
+        self._full_pending = True
+        self._schedule()
+
+    def request_update(self):
+        """Применение накопленных изменений к снимку в фоне, без чтения базы"""
+        self._update_pending = True
+        self._schedule()
+
+    def _schedule(self):
+        # Вызов во время идущей пересборки запускает ещё одну после неё
+        if not config.CATALOG_CACHE_ENABLED:
+            return
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._rebuild_loop())
+
+    async def _rebuild_loop(self):
+        while self._full_pending or self._update_pending:
+            full = self._full_pending or self.snapshot is None
+            self._full_pending = self._update_pending = False
+            try:
+                if full:
+                    await self.rebuild()
+                else:
+                    await self.apply_changes()
+            except Exception as e:
+                logger.error(f"Ошибка при пересборке каталога для API: {str(e)}")
+
+    async def get(self) -> CatalogSnapshot:
+        if self.snapshot is None and self._task is not None and not self._task.done():
+            # Первая пересборка уже идёт - дожидаемся её, а не запускаем вторую
+            await asyncio.shield(self._task)
+        if self.snapshot is None:
+            await self.rebuild()
+        return self.snapshot
+
+catalog_cache = CatalogCache()
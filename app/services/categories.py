@@ -1,46 +1,39 @@
-import httpx
-from app.db.supabase_client import supabase
+from app.db.writer import BatchWriter
 from app.core import config
-from app.logger import logger
-from app.services.utils import get_headers, log_response_details
+from app.logger import logger, log_sampled
+from app.services.mapping import Category, map_rows
+from app.services.pagination import iter_batches, iter_rows
+from app.services.catalog import catalog_cache
+from app.services.fingerprints import fingerprint_store
+from app.services.sync_state import updated_since_params
 
-async def sync_categories():
+async def sync_categories(updated_since: str = None, rows=None) -> bool:
     try:
-        logger.info("Начинаем синхронизацию категорий")
-        
-        headers = get_headers()
-        if not headers:
-            logger.error("Не удалось получить заголовки для запроса. Синхронизация прервана.")
-            return
+        logger.info(f"Начинаем синхронизацию категорий{f' (изменённые с {updated_since})' if updated_since else ''}")
         
         url = f"{config.MS_BASE_URL}/entity/productfolder"
-        params = {
-            "limit": 100
-        }
-        
         logger.info(f"Запрашиваем категории: {url}")
-        response = httpx.get(url, headers=headers, params=params)
-        log_response_details(response, url)
-        
-        response.raise_for_status()
-        data = response.json()["rows"]
-        logger.info(f"Получено {len(data)} категорий для обработки")
 
-        for i, cat in enumerate(data):
-            try:
-                logger.info(f"Обработка категории {i+1}/{len(data)}: {cat.get('name', 'Без имени')}")
-                
-                supabase.table("categories").upsert({
-                    "id": cat["id"],
-                    "name": cat["name"],
-                    "parent_id": cat.get("productFolder", {}).get("meta", {}).get("href", "").split("/")[-1] if cat.get("productFolder") else None
-                }).execute()
-                
-            except Exception as e:
-                logger.error(f"Ошибка при обработке категории {cat.get('name', 'Без имени')}: {str(e)}")
-                continue
+        processed = 0
+        async with BatchWriter(
+            "categories", on_commit=catalog_cache.observer("categories"), fingerprints=fingerprint_store
+        ) as writer:
+            async for batch in iter_batches(rows or iter_rows(url, updated_since_params(updated_since))):
+                for cat in map_rows(batch, Category):
+                    try:
+                        processed += 1
+                        log_sampled("categories", "Обработка категории {}: {}", processed, cat.name)
+                        await writer.add(cat.to_row())
+                    except Exception as e:
+                        logger.error(f"Ошибка при обработке категории {cat.name}: {str(e)}")
+                        continue
 
-        logger.info("Категории синхронизированы успешно")
+        if writer.failed:
+            logger.error(f"Категории синхронизированы с ошибками: обработано {processed}, не записано {writer.failed}")
+            return False
+        logger.info(f"Категории синхронизированы успешно: обработано {processed}")
+        return True
     except Exception as e:
         logger.error(f"Ошибка при синхронизации категорий: {str(e)}")
+        return False
 
@@ -0,0 +1,100 @@
+import time
+import uuid
+from app.core import config
+from app.db.local_store import connect
+from app.logger import logger
+
+class CheckpointStore:
+    """
+    Контрольные точки прогонов синхронизации в локальной SQLite. Для прогона
+    хранятся run_id, отметка времени для sync_state и, по каждой сущности,
+    число строк коллекции МойСклад, уже записанных в Supabase (offset, с
+    которого продолжать), и признак завершения. Прерванный прогон не моложе
+    SYNC_CHECKPOINT_MAX_AGE_SECONDS продолжается с последней записанной пачки.
+    """
+
+    def __init__(self, db_name: str = "checkpoints.sqlite", max_age: float = None):
+        self.max_age = max_age or config.SYNC_CHECKPOINT_MAX_AGE_SECONDS
+        self._conn = connect(db_name)
+        self._conn.execute(
+            """
+            create table if not exists runs (
+                run_id text primary key,
+                kind text not null,
+                watermark text,
+                started_at real not null,
+                finished_at real,
+                status text not null
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            create table if not exists checkpoints (
+                run_id text not null,
+                entity text not null,
+                position integer not null,
+                done integer not null default 0,
+                updated_at real not null,
+                primary key (run_id, entity)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def resumable(self, kind: str) -> dict:
+        """Последний незавершённый прогон kind, который ещё можно продолжить, или None"""
+        row = self._conn.execute(
+            "select run_id, watermark, started_at from runs "
+            "where kind = ? and status = 'running' and started_at >= ? order by started_at desc limit 1",
+            (kind, time.time() - self.max_age),
+        ).fetchone()
+        if not row:
+            return None
+        positions = {
+            entity: (position, bool(done))
+            for entity, position, done in self._conn.execute(
+                "select entity, position, done from checkpoints where run_id = ?", (row[0],)
+            )
+        }
+        return {"run_id": row[0], "watermark": row[1], "started_at": row[2], "positions": positions, "resumed": True}
+
+    def begin(self, kind: str, watermark: str) -> dict:
+        """Продолжает прерванный прогон kind или начинает новый"""
+        run = self.resumable(kind)
+        if run:
+            logger.info(f"Продолжаем прерванный прогон {kind} {run['run_id']}: {run['positions']}")
+            return run
+        # Старые незавершённые прогоны больше не продолжаются
+        self._conn.execute("update runs set status = 'abandoned' where kind = ? and status = 'running'", (kind,))
+        run_id = uuid.uuid4().hex
+        started_at = time.time()
+        self._conn.execute(
+            "insert into runs (run_id, kind, watermark, started_at, status) values (?, ?, ?, ?, 'running')",
+            (run_id, kind, watermark, started_at),
+        )
+        self._conn.commit()
+        return {"run_id": run_id, "watermark": watermark, "started_at": started_at, "positions": {}, "resumed": False}
+
+    def save(self, run_id: str, entity: str, position: int, done: bool = False):
+        self._conn.execute(
+            "insert or replace into checkpoints (run_id, entity, position, done, updated_at) values (?, ?, ?, ?, ?)",
+            (run_id, entity, position, int(done), time.time()),
+        )
+        self._conn.commit()
+
+    def finish(self, run_id: str, status: str = "ok"):
+        self._conn.execute(
+            "update runs set status = ?, finished_at = ? where run_id = ?", (status, time.time(), run_id)
+        )
+        self._conn.execute("delete from checkpoints where run_id = ?", (run_id,))
+        self._conn.commit()
+
+    def last_success(self, kind: str) -> float:
+        """Время окончания последнего успешного прогона kind (time.time()) или None"""
+        row = self._conn.execute(
+            "select max(finished_at) from runs where kind = ? and status = 'ok'", (kind,)
+        ).fetchone()
+        return row[0] if row else None
+
+checkpoint_store = CheckpointStore()
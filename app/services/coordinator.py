@@ -0,0 +1,278 @@
+import asyncio
+import functools
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from app.core import config
+from app.db.local_store import connect
+from app.logger import logger
+
+# Фазы распределённого прогона: раздел фазы выдаётся только после завершения всех разделов
+# предыдущих фаз (внешние ключи: категории и остатки -> товары -> модификации)
+PHASES = {"categories": 0, "stock": 0, "products": 1, "variants": 2}
+
+def instance_id() -> str:
+    # Уникален для процесса: несколько воркеров на одном хосте различаются pid
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+class Coordinator:
+    """
+    Координация нескольких экземпляров сервиса через общую таблицу аренд
+    (SQLite-файл SHARD_COORDINATOR_PATH, общий для всех экземпляров).
+
+    - Аренда "scheduler": планировщик работает только у держателя аренды.
+    - Прогон полной синхронизации делится на разделы (диапазоны строк
+      коллекций МойСклад); воркеры берут разделы в аренду, продлевают её
+      во время работы и отмечают завершение. Раздел упавшего воркера
+      освобождается по истечении аренды и достаётся другому.
+    - Остатки по складам, загруженные разделами фазы stock, хранятся здесь
+      же и читаются разделами товаров и модификаций.
+    """
+
+    def __init__(self, path: str = None, owner: str = None, lease_seconds: float = None):
+        self.owner = owner or instance_id()
+        self.lease_seconds = lease_seconds or config.SHARD_LEASE_SECONDS
+        self._conn = connect(path or config.SHARD_COORDINATOR_PATH)
+        # Явные транзакции (BEGIN IMMEDIATE) для атомарного захвата раздела несколькими процессами
+        self._conn.isolation_level = None
+        self._conn.execute("PRAGMA busy_timeout=10000")
+        self._lock = threading.Lock()
+        self._leader_until = 0.0
+        self._leadership_task = None
+        self._conn.executescript(
+            """
+            create table if not exists leases (
+                name text primary key,
+                owner text not null,
+                expires_at real not null
+            );
+            create table if not exists shard_runs (
+                run_id text primary key,
+                watermark text,
+                created_at real not null,
+                finished_at real,
+                status text not null
+            );
+            create table if not exists partitions (
+                run_id text not null,
+                part_id integer not null,
+                phase integer not null,
+                entity text not null,
+                start integer not null,
+                stop integer not null,
+                status text not null default 'pending',
+                owner text,
+                expires_at real,
+                attempts integer not null default 0,
+                primary key (run_id, part_id)
+            );
+            create table if not exists run_stock (
+                run_id text not null,
+                id text not null,
+                stock text not null,
+                primary key (run_id, id)
+            ) without rowid;
+            """
+        )
+
+    def _read(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _write(self, func):
+        # Одна транзакция записи; BEGIN IMMEDIATE сразу берёт блокировку записи базы
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(self._conn)
+                self._conn.execute("COMMIT")
+                return result
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    # --- Аренды (лидерство планировщика) ---
+
+    def acquire(self, name: str, ttl: float = None) -> bool:
+        """Берёт или продлевает аренду name; False, если она у другого экземпляра и не истекла"""
+        now = time.time()
+        expires_at = now + (ttl or self.lease_seconds)
+
+        def txn(conn):
+            conn.execute(
+                "insert into leases (name, owner, expires_at) values (?, ?, ?) "
+                "on conflict(name) do update set owner = excluded.owner, expires_at = excluded.expires_at "
+                "where leases.owner = excluded.owner or leases.expires_at < ?",
+                (name, self.owner, expires_at, now),
+            )
+            row = conn.execute("select owner from leases where name = ?", (name,)).fetchone()
+            return row is not None and row[0] == self.owner
+        return self._write(txn)
+
+    def release(self, name: str):
+        self._write(lambda conn: conn.execute("delete from leases where name = ? and owner = ?", (name, self.owner)))
+
+    def is_leader(self) -> bool:
+        return time.time() < self._leader_until
+
+    async def _keep_leadership(self, name: str):
+        was_leader = False
+        while True:
+            try:
+                started = time.time()
+                if await asyncio.to_thread(self.acquire, name):
+                    self._leader_until = started + self.lease_seconds
+                else:
+                    self._leader_until = 0.0
+            except Exception as e:
+                logger.error(f"Ошибка при продлении аренды {name}: {str(e)}")
+            if self.is_leader() != was_leader:
+                was_leader = self.is_leader()
+                logger.info(f"Экземпляр {self.owner} {'стал' if was_leader else 'больше не'} лидером ({name})")
+            await asyncio.sleep(self.lease_seconds / 3)
+
+    def start_leadership(self, name: str = "scheduler"):
+        if self._leadership_task is None:
+            self._leadership_task = asyncio.create_task(self._keep_leadership(name))
+
+    async def stop_leadership(self, name: str = "scheduler"):
+        if self._leadership_task is not None:
+            self._leadership_task.cancel()
+            self._leadership_task = None
+            self._leader_until = 0.0
+            await asyncio.to_thread(self.release, name)
+
+    # --- Прогоны и разделы ---
+
+    def active_run(self) -> dict:
+        rows = self._read(
+            "select run_id, watermark, created_at from shard_runs where status = 'running' "
+            "order by created_at limit 1"
+        )
+        return {"run_id": rows[0][0], "watermark": rows[0][1], "created_at": rows[0][2]} if rows else None
+
+    def plan_run(self, watermark: str, partitions: list) -> str:
+        """partitions - [(entity, start, stop)]; возвращает run_id"""
+        run_id = uuid.uuid4().hex
+
+        def txn(conn):
+            conn.execute(
+                "insert into shard_runs (run_id, watermark, created_at, status) values (?, ?, ?, 'running')",
+                (run_id, watermark, time.time()),
+            )
+            conn.executemany(
+                "insert into partitions (run_id, part_id, phase, entity, start, stop) values (?, ?, ?, ?, ?, ?)",
+                [(run_id, i, PHASES[entity], entity, start, stop) for i, (entity, start, stop) in enumerate(partitions)],
+            )
+        self._write(txn)
+        return run_id
+
+    def claim(self) -> dict:
+        """Берёт в аренду свободный (или брошенный) раздел самой ранней незавершённой фазы"""
+        now = time.time()
+
+        def txn(conn):
+            run = conn.execute(
+                "select run_id from shard_runs where status = 'running' order by created_at limit 1"
+            ).fetchone()
+            if not run:
+                return None
+            phase = conn.execute(
+                "select min(phase) from partitions where run_id = ? and status not in ('done', 'failed')", run
+            ).fetchone()[0]
+            if phase is None:
+                return None
+            row = conn.execute(
+                "select part_id, entity, start, stop, attempts from partitions "
+                "where run_id = ? and phase = ? and (status = 'pending' or (status = 'leased' and expires_at < ?)) "
+                "order by part_id limit 1",
+                (run[0], phase, now),
+            ).fetchone()
+            if not row:
+                return None
+            conn.execute(
+                "update partitions set status = 'leased', owner = ?, expires_at = ?, attempts = attempts + 1 "
+                "where run_id = ? and part_id = ?",
+                (self.owner, now + self.lease_seconds, run[0], row[0]),
+            )
+            return {"run_id": run[0], "part_id": row[0], "entity": row[1], "start": row[2], "stop": row[3],
+                    "attempt": row[4] + 1}
+        return self._write(txn)
+
+    def renew(self, part: dict) -> bool:
+        def txn(conn):
+            cursor = conn.execute(
+                "update partitions set expires_at = ? where run_id = ? and part_id = ? and owner = ? and status = 'leased'",
+                (time.time() + self.lease_seconds, part["run_id"], part["part_id"], self.owner),
+            )
+            return cursor.rowcount == 1
+        return self._write(txn)
+
+    def complete(self, part: dict, success: bool):
+        """Отмечает раздел выполненным; неудачный возвращается в очередь до SHARD_MAX_ATTEMPTS попыток"""
+        if success:
+            status = "done"
+        else:
+            status = "failed" if part["attempt"] >= config.SHARD_MAX_ATTEMPTS else "pending"
+        self._write(lambda conn: conn.execute(
+            "update partitions set status = ?, owner = null, expires_at = null "
+            "where run_id = ? and part_id = ? and owner = ?",
+            (status, part["run_id"], part["part_id"], self.owner),
+        ))
+
+    def run_progress(self, run_id: str) -> dict:
+        """{статус раздела: количество}"""
+        return dict(self._read(
+            "select status, count(*) from partitions where run_id = ? group by status", (run_id,)
+        ))
+
+    def finish_run(self, run_id: str, status: str):
+        def txn(conn):
+            conn.execute(
+                "update shard_runs set status = ?, finished_at = ? where run_id = ?", (status, time.time(), run_id)
+            )
+            conn.execute("delete from run_stock where run_id = ?", (run_id,))
+        self._write(txn)
+
+    # --- Остатки прогона ---
+
+    def save_stock(self, run_id: str, page: dict):
+        rows = [(run_id, row_id, json.dumps(stock_data, ensure_ascii=False)) for row_id, stock_data in page.items()]
+        self._write(lambda conn: conn.executemany(
+            "insert or replace into run_stock (run_id, id, stock) values (?, ?, ?)", rows
+        ))
+
+    def stock_for(self, run_id: str, ids: list) -> dict:
+        """
+        Остатки прогона для пачки ID одним запросом: {ID: {склад: остаток}}.
+        Вызывать через asyncio.to_thread - запрос может ждать блокировку записи.
+        """
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        rows = self._read(
+            f"select id, stock from run_stock where run_id = ? and id in ({placeholders})", (run_id, *ids)
+        )
+        return {row_id: json.loads(stock) for row_id, stock in rows}
+
+def leader_only(job):
+    """Задача планировщика выполняется только у лидера (в режиме SHARD_MODE)"""
+    @functools.wraps(job)
+    async def wrapper(*args, **kwargs):
+        if config.SHARD_MODE and not get_coordinator().is_leader():
+            logger.debug("{}: экземпляр не лидер, запуск пропущен", job.__name__)
+            return None
+        return await job(*args, **kwargs)
+    return wrapper
+
+coordinator = None
+
+def get_coordinator() -> Coordinator:
+    # Создаётся только в режиме SHARD_MODE: в обычном режиме файл координации не нужен
+    global coordinator
+    if coordinator is None:
+        coordinator = Coordinator()
+    return coordinator
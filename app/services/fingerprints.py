@@ -0,0 +1,87 @@
+import hashlib
+import json
+import threading
+from app.core import config
+from app.db.local_store import connect
+from app.logger import logger
+
+class FingerprintStore:
+    """
+    Отпечатки последних записанных строк: таблица -> ID -> 16-байтовый хэш
+    строки (название, описание, категория, цены, остатки, характеристики,
+    image_url и т.д.). Хранятся в локальной SQLite и целиком загружаются в
+    память при старте. BatchWriter не отправляет строки, отпечаток которых
+    не изменился.
+
+    shared=True (SHARD_MODE: файл в DATA_DIR общий для всех воркеров) -
+    отпечатки не кэшируются в памяти, а читаются из SQLite при каждой
+    проверке: записи и сбросы других процессов видны сразу.
+    """
+
+    def __init__(self, db_name: str = "fingerprints.sqlite", shared: bool = None):
+        self.shared = config.SHARD_MODE if shared is None else shared
+        self._conn = connect(db_name)
+        # Запись идёт и из цикла событий, и из потоков to_thread
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "create table if not exists fingerprints ("
+            "tbl text not null, id text not null, hash blob not null, "
+            "primary key (tbl, id)) without rowid"
+        )
+        self._conn.commit()
+        self._hashes = {}
+        if self.shared:
+            # Запись другого процесса ждём, а не падаем с "database is locked"
+            self._conn.execute("PRAGMA busy_timeout=10000")
+            # Проверки идут в цикле событий через отдельное соединение: в WAL чтение
+            # не ждёт ни блокировки записи, ни self._lock, занятого записью в потоке
+            self._read_conn = connect(db_name)
+            logger.info("Отпечатки строк читаются из общего файла")
+            return
+        for table, row_id, digest in self._conn.execute("select tbl, id, hash from fingerprints"):
+            self._hashes.setdefault(table, {})[row_id] = digest
+        logger.info(f"Загружено отпечатков строк: {sum(len(h) for h in self._hashes.values())}")
+
+    @staticmethod
+    def fingerprint(row: dict) -> bytes:
+        # sort_keys - чтобы порядок ключей в jsonb-полях не менял отпечаток
+        payload = json.dumps(row, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+        return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).digest()
+
+    def _stored(self, table: str, row_id) -> bytes:
+        if self.shared:
+            found = self._read_conn.execute(
+                "select hash from fingerprints where tbl = ? and id = ?", (table, row_id)
+            ).fetchone()
+            return found[0] if found else None
+        return self._hashes.get(table, {}).get(row_id)
+
+    def is_unchanged(self, table: str, row: dict) -> bool:
+        stored = self._stored(table, row["id"])
+        return stored is not None and stored == self.fingerprint(row)
+
+    def record(self, table: str, rows: list):
+        """Запоминает отпечатки успешно записанных строк (вызывается после записи пачки)"""
+        hashes = self._hashes.setdefault(table, {})
+        values = []
+        for row in rows:
+            digest = self.fingerprint(row)
+            if not self.shared:
+                hashes[row["id"]] = digest
+            values.append((table, row["id"], digest))
+        with self._lock:
+            self._conn.executemany("insert or replace into fingerprints (tbl, id, hash) values (?, ?, ?)", values)
+            self._conn.commit()
+
+    def forget(self, table: str, ids: list):
+        # Строка изменена в обход синхронизации (удалена, поправлена частично) - отпечаток недействителен
+        hashes = self._hashes.get(table, {})
+        for row_id in ids:
+            hashes.pop(row_id, None)
+        with self._lock:
+            self._conn.executemany(
+                "delete from fingerprints where tbl = ? and id = ?", [(table, row_id) for row_id in ids]
+            )
+            self._conn.commit()
+
+fingerprint_store = FingerprintStore()
@@ -0,0 +1,145 @@
+import asyncio
+import time
+import httpx
+from contextlib import asynccontextmanager
+from app.core import config
+from app.logger import logger
+from app.services.metrics import metrics
+from app.services.rate_limiter import rate_limiter
+from app.services.utils import get_headers, log_response_details
+
+# Единый на процесс HTTP-клиент: пул соединений, keep-alive и (опционально) HTTP/2.
+# Создаётся при старте приложения (lifespan) и закрывается при остановке.
+_client: httpx.AsyncClient = None
+
+def _http2_available() -> bool:
+    if not config.HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logger.warning("HTTP/2 включен, но пакет h2 не установлен. Используем HTTP/1.1")
+        return False
+
+def _build_client() -> httpx.AsyncClient:
+    headers = get_headers()
+    if not headers:
+        raise RuntimeError("Не удалось получить заголовки для HTTP-клиента МойСклад")
+
+    limits = httpx.Limits(
+        max_connections=config.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(config.HTTP_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT)
+    return httpx.AsyncClient(
+        headers=headers,
+        limits=limits,
+        timeout=timeout,
+        http2=_http2_available(),
+    )
+
+async def start_client():
+    global _client
+    if _client is None:
+        try:
+            _client = _build_client()
+            logger.info("HTTP-клиент МойСклад создан")
+        except RuntimeError as e:
+            # Приложение поднимается и без токена, синхронизации просто завершатся с ошибкой
+            logger.error(str(e))
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        logger.info("HTTP-клиент МойСклад закрыт")
+
+def get_client() -> httpx.AsyncClient:
+    # Ленивое создание нужно для запуска синхронизации вне FastAPI (скрипты, отладка)
+    global _client
+    if _client is None:
+        _client = _build_client()
+    return _client
+
+async def ms_post(url: str, json=None, **kwargs) -> httpx.Response:
+    """POST-запрос к МойСклад: проходит через ограничитель, но не повторяется (не идемпотентен)"""
+    async with rate_limiter.slot():
+        started = time.monotonic()
+        response = await get_client().post(url, json=json, **kwargs)
+    metrics.observe_ms_response(response, time.monotonic() - started)
+    rate_limiter.observe(response)
+    log_response_details(response, url)
+    return response
+
+# Статусы, при которых GET безопасно повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+async def _send_get(url: str, params: dict, stream: bool, **kwargs) -> httpx.Response:
+    client = get_client()
+    if not stream:
+        return await client.get(url, params=params, **kwargs)
+    return await client.send(client.build_request("GET", url, params=params), stream=True, **kwargs)
+
+async def _get(url: str, params: dict = None, stream: bool = False, **kwargs) -> httpx.Response:
+    attempt = 0
+    while True:
+        try:
+            async with rate_limiter.slot():
+                started = time.monotonic()
+                response = await _send_get(url, params, stream, **kwargs)
+        except httpx.TransportError as e:
+            metrics.observe_ms_error(httpx.URL(url).path, time.monotonic() - started)
+            if attempt >= config.MS_MAX_RETRIES:
+                raise
+            delay = rate_limiter.backoff(attempt)
+            rate_limiter.record_retry()
+            logger.warning(f"Сетевая ошибка {url}: {str(e)}. Повтор через {delay:.1f} с")
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+
+        # Для потокового ответа - время до заголовков, тело ещё не прочитано
+        metrics.observe_ms_response(response, time.monotonic() - started)
+        rate_limiter.observe(response)
+        if stream and response.status_code >= 400:
+            # Тело ошибки небольшое, читаем его целиком для лога
+            await response.aread()
+        if not stream or response.status_code >= 400:
+            log_response_details(response, url)
+
+        if response.status_code in RETRY_STATUSES and attempt < config.MS_MAX_RETRIES:
+            delay = rate_limiter.backoff(attempt, response)
+            rate_limiter.record_retry()
+            logger.warning(f"{url}: статус {response.status_code}, повтор через {delay:.1f} с")
+            await response.aclose()
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+
+        return response
+
+async def ms_get(url: str, params: dict = None, **kwargs) -> httpx.Response:
+    """
+    GET-запрос к МойСклад через общий клиент и общий ограничитель частоты.
+    GET идемпотентен, поэтому 429/5xx и сетевые ошибки повторяются
+    с экспоненциальной задержкой (не более MS_MAX_RETRIES раз).
+    """
+    return await _get(url, params, **kwargs)
+
+@asynccontextmanager
+async def ms_stream(url: str, params: dict = None, **kwargs):
+    """
+    То же, что ms_get, но тело ответа не читается заранее: его можно разбирать
+    по мере прихода (response.aiter_bytes()). Повторяется только получение
+    статуса и заголовков, обрыв во время чтения тела пробрасывается наружу.
+    """
+    response = await _get(url, params, stream=True, **kwargs)
+    try:
+        yield response
+    finally:
+        await response.aclose()
+        if response.status_code < 400:
+            log_response_details(response, url)
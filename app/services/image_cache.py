@@ -0,0 +1,136 @@
+import hashlib
+import json
+import threading
+import time
+from app.core import config
+from app.db.local_store import connect
+from app.logger import logger
+from app.services import transcode
+
+class ImageCache:
+    """
+    Манифест загруженных изображений: ID товара/модификации -> метаданные
+    изображения МойСклад (updated, filename, size), хэш содержимого и URL в
+    Supabase Storage (при перекодировании - ещё URL размеров и профиль
+    перекодирования). Если метаданные и профиль не изменились, изображение не
+    скачивается повторно. Размер манифеста ограничен max_entries: самые давно
+    использованные записи вытесняются.
+    """
+
+    def __init__(self, db_name: str = "image_cache.sqlite", max_entries: int = None):
+        self.max_entries = max_entries or config.IMAGE_CACHE_MAX_ENTRIES
+        self._conn = connect(db_name)
+        self._conn.execute(
+            """
+            create table if not exists images (
+                item_id text primary key,
+                updated text,
+                filename text,
+                size integer,
+                content_hash text,
+                url text,
+                last_used real
+            )
+            """
+        )
+        # Манифест, созданный до перекодирования изображений, дополняем новыми колонками
+        columns = {row[1] for row in self._conn.execute("pragma table_info(images)")}
+        for column in ("variants", "profile"):
+            if column not in columns:
+                self._conn.execute(f"alter table images add column {column} text")
+        self._conn.execute("create index if not exists images_last_used on images(last_used)")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+        # last_used попаданий копится в памяти и пишется одной транзакцией вне цикла событий
+        # (flush_touched): незакоммиченный UPDATE держал бы блокировку записи общего файла
+        self._touched = {}
+        self._touched_lock = threading.Lock()
+
+    @staticmethod
+    def content_hash(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def _meta_key(img_meta: dict) -> tuple:
+        return (img_meta.get("updated"), img_meta.get("filename"), img_meta.get("size"))
+
+    @staticmethod
+    def _fields(url: str, variants: str) -> dict:
+        return transcode.image_fields(url, json.loads(variants) if variants else None)
+
+    def lookup(self, item_id: str, img_meta: dict) -> dict:
+        """Поля изображения строки из манифеста, если изображение в МойСклад не менялось, иначе None"""
+        row = self._conn.execute(
+            "select updated, filename, size, url, variants, profile from images where item_id = ?", (item_id,)
+        ).fetchone()
+        if (row and row[3] and tuple(row[:3]) == self._meta_key(img_meta)
+                and (row[5] or "") == transcode.profile()):
+            self.hits += 1
+            with self._touched_lock:
+                self._touched[item_id] = time.time()
+            return self._fields(row[3], row[4])
+        self.misses += 1
+        return None
+
+    def get_fields(self, item_id: str) -> dict:
+        row = self._conn.execute("select url, variants from images where item_id = ?", (item_id,)).fetchone()
+        return self._fields(row[0], row[1]) if row else None
+
+    def same_content(self, item_id: str, content_hash: str) -> dict:
+        """
+        Метаданные изменились, а байты и профиль перекодирования те же - повторная
+        загрузка в Storage не нужна: возвращает поля изображения из манифеста, иначе None
+        """
+        row = self._conn.execute(
+            "select content_hash, url, variants, profile from images where item_id = ?", (item_id,)
+        ).fetchone()
+        if row and row[1] and row[0] == content_hash and (row[3] or "") == transcode.profile():
+            return self._fields(row[1], row[2])
+        return None
+
+    def store(self, item_id: str, img_meta: dict, content_hash: str, url: str, variants: dict = None):
+        updated, filename, size = self._meta_key(img_meta)
+        self._conn.execute(
+            "insert or replace into images "
+            "(item_id, updated, filename, size, content_hash, url, variants, profile, last_used) "
+            "values (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (item_id, updated, filename, size, content_hash, url,
+             json.dumps(variants) if variants else None, transcode.profile(), time.time()),
+        )
+        self._conn.commit()
+        self.flush_touched()
+        self._evict()
+
+    def flush_touched(self):
+        """Записывает отложенные last_used попаданий (вызывать через asyncio.to_thread)"""
+        with self._touched_lock:
+            touched, self._touched = self._touched, {}
+        if not touched:
+            return
+        self._conn.executemany(
+            "update images set last_used = ? where item_id = ?",
+            [(last_used, item_id) for item_id, last_used in touched.items()],
+        )
+        self._conn.commit()
+
+    def _evict(self):
+        count = self._conn.execute("select count(*) from images").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "delete from images where item_id in "
+                "(select item_id from images order by last_used limit ?)",
+                (excess,),
+            )
+            self._conn.commit()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def log_stats(self, label: str):
+        logger.info(f"[{label}] Кэш изображений: попаданий {self.hits}, промахов {self.misses}")
+        self.reset_stats()
+
+image_cache = ImageCache()
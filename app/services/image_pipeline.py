@@ -0,0 +1,88 @@
+import asyncio
+from app.core import config
+from app.logger import logger
+from app.services.image_cache import image_cache
+from app.services.storage import upload_image
+
+class ImagePipeline:
+    """
+    Стадия изображений, отделённая от записи строк. Строки пишутся сразу,
+    а скачивание из МойСклад и загрузка в Storage идут в пуле из workers
+    задач. Очередь ограничена queue_size: когда она заполнена, submit ждёт,
+    и стадия строк притормаживает вместо роста памяти. Готовые поля
+    изображения (image_url, image_variants) дописываются в строку через writer.patch.
+    """
+
+    def __init__(self, writer, workers: int = None, queue_size: int = None):
+        self.writer = writer
+        self.workers = workers or config.IMAGE_WORKERS
+        self._queue = asyncio.Queue(maxsize=queue_size or config.IMAGE_QUEUE_SIZE)
+        self._tasks = []
+        self.uploaded = 0
+        self.failed = 0
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is asyncio.CancelledError:
+            # При отмене очередь не дожидаемся: загрузки прерываются вместе со стадией
+            for task in self._tasks:
+                task.cancel()
+            self._tasks = []
+            return
+        await self.close()
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def resolve(self, item: dict):
+        """
+        Возвращает (image, pending): поля изображения, которые можно записать
+        в строку сразу (или None), и нужна ли загрузка. Неизменённое изображение берётся из
+        манифеста без обращения к МойСклад.
+        """
+        images = item.get("images")
+        if not images or not images.get("meta", {}).get("size") or not images.get("rows"):
+            return None, False
+        cached = image_cache.lookup(item["id"], images["rows"][0])
+        if cached:
+            return cached, False
+        # Пока новое изображение грузится, в строке остаются прежние URL
+        return image_cache.get_fields(item["id"]), True
+
+    async def submit(self, item: dict, current: dict = None):
+        # В очередь кладём только то, что нужно для загрузки, а не всю строку МойСклад
+        job = ({"id": item["id"], "images": item["images"]}, current)
+        await self._queue.put(job)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job is None:
+                    return
+                item, current = job
+                image = await upload_image(item, check_cache=False)
+                if not image:
+                    self.failed += 1
+                    continue
+                self.uploaded += 1
+                if image != current:
+                    self.writer.patch(item["id"], image)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Ошибка в стадии изображений: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    async def close(self):
+        """Дожидается всех изображений из очереди и останавливает пул"""
+        for _ in self._tasks:
+            await self._queue.put(None)
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info(
+            f"[{self.writer.table}] Стадия изображений завершена: загружено {self.uploaded}, ошибок {self.failed}"
+        )
@@ -0,0 +1,58 @@
+import json
+from app.core import config
+from app.logger import logger
+
+# Быстрый разбор JSON (необязательно): если orjson не установлен, используется стандартный json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Потоковый разбор JSON (необязательно): без ijson страницы разбираются целиком
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+_warned = False
+
+def loads(data):
+    """Разбирает JSON-ответ целиком, через orjson, если он установлен"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dumps(obj) -> bytes:
+    """Сериализует в JSON (UTF-8), через orjson, если он установлен"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def streaming_enabled() -> bool:
+    global _warned
+    if not config.MS_STREAM_JSON:
+        return False
+    if ijson is None:
+        if not _warned:
+            logger.warning("Потоковый разбор JSON включен, но пакет ijson не установлен. Разбираем страницы целиком")
+            _warned = True
+        return False
+    return True
+
+async def iter_stream_items(response, prefix: str = "rows.item"):
+    """
+    Отдаёт элементы массива prefix из тела ответа по мере прихода байтов.
+    Вся страница в памяти не собирается: одновременно живут только строки
+    из последнего прочитанного куска тела.
+    """
+    items = ijson.sendable_list()
+    # use_float: иначе дробные числа придут как Decimal, а их не сериализовать в запрос к Supabase
+    parser = ijson.items_coro(items, prefix, use_float=True)
+    async for chunk in response.aiter_bytes():
+        parser.send(chunk)
+        for item in items:
+            yield item
+        del items[:]
+    parser.close()
+    for item in items:
+        yield item
@@ -0,0 +1,120 @@
+from app.logger import logger
+from app.services.metrics import metrics
+from app.services.transcode import image_fields
+from app.services.utils import extract_id
+
+# Отображение строк МойСклад в компактные записи за один проход.
+# Записи со __slots__ не держат __dict__ на каждый объект и не тянут за собой
+# исходную строку: из неё сохраняется только то, что пишется в Supabase.
+
+def _href(obj) -> str:
+    # obj["meta"]["href"] для вложенных ссылок (productFolder, product, priceType, ...)
+    if not obj:
+        return None
+    meta = obj.get("meta")
+    return meta.get("href") if meta else None
+
+def map_prices(sale_prices, price_types: dict) -> dict:
+    """salePrices -> {название типа цены: цена в рублях}; цены с неизвестным типом пропускаются"""
+    prices = {}
+    for price in sale_prices or ():
+        name = price_types.get(extract_id(_href(price.get("priceType"))))
+        if name is not None:
+            prices[name] = price["value"] / 100
+    return prices
+
+class Category:
+    __slots__ = ("id", "name", "parent_id")
+
+    def __init__(self, raw: dict):
+        self.id = raw["id"]
+        self.name = raw["name"]
+        self.parent_id = extract_id(_href(raw.get("productFolder")))
+
+    def to_row(self) -> dict:
+        return {"id": self.id, "name": self.name, "parent_id": self.parent_id}
+
+class Product:
+    __slots__ = ("id", "name", "description", "category_id", "prices", "images")
+
+    def __init__(self, raw: dict, price_types: dict):
+        self.id = raw["id"]
+        self.name = raw.get("name", "Без имени")
+        self.description = raw.get("description")
+        self.category_id = extract_id(_href(raw.get("productFolder")))
+        self.prices = map_prices(raw.get("salePrices"), price_types)
+        self.images = raw.get("images")
+
+    def image_item(self) -> dict:
+        # Минимальный элемент для стадии изображений (ImagePipeline.resolve/submit)
+        return {"id": self.id, "images": self.images} if self.images else {}
+
+    def to_row(self, image: dict, stock: dict) -> dict:
+        # image - поля изображения из ImagePipeline.resolve (image_url, image_variants) или None;
+        # stock=None - остатки не загрузились, колонка stock в строку не попадает
+        return {
+            "id": self.id,
+            "name": self.name,
+            "description": self.description,
+            **(image or image_fields(None)),
+            "category_id": self.category_id,
+            "prices": self.prices,
+            **({} if stock is None else {"stock": stock}),
+        }
+
+class Variant:
+    __slots__ = ("id", "name", "product_id", "characteristics", "prices", "images")
+
+    def __init__(self, raw: dict, price_types: dict):
+        self.id = raw["id"]
+        self.name = raw.get("name", "Без имени")
+        self.product_id = extract_id(_href(raw.get("product")))
+        self.characteristics = raw.get("characteristics", [])
+        # Цены модификаций, как и у товаров, - по названию типа цены
+        self.prices = map_prices(raw.get("salePrices"), price_types)
+        self.images = raw.get("images")
+
+    def image_item(self) -> dict:
+        return {"id": self.id, "images": self.images} if self.images else {}
+
+    def to_row(self, image: dict, stock: dict) -> dict:
+        return {
+            "id": self.id,
+            "product_id": self.product_id,
+            "name": self.name,
+            "characteristics": self.characteristics,
+            **(image or image_fields(None)),
+            "prices": self.prices,
+            **({} if stock is None else {"stock": stock}),
+        }
+
+class StockEntry:
+    """Строка отчёта report/stock/bystore: ID товара/модификации и {склад: остаток}"""
+
+    __slots__ = ("id", "stock")
+
+    def __init__(self, raw: dict, stores: dict):
+        self.id = extract_id(_href(raw))
+        self.stock = {}
+        for store_stock in raw.get("stockByStore", ()):
+            store_id = extract_id(_href(store_stock))
+            if not store_id:
+                continue
+            # Если склада нет в общем списке, берём название прямо из отчёта
+            store_name = stores.get(store_id) or store_stock.get("name")
+            if store_name:
+                self.stock[store_name] = store_stock.get("stock", 0.0)
+
+def map_rows(rows: list, record_type, *args) -> list:
+    """
+    Пакетное отображение: строки МойСклад -> записи record_type(raw, *args).
+    Строка с ошибкой пропускается с записью в лог, остальные отображаются.
+    """
+    records = []
+    for raw in rows:
+        try:
+            records.append(record_type(raw, *args))
+        except Exception as e:
+            metrics.rows.inc(record_type.__name__, "invalid")
+            logger.error(f"Ошибка при разборе строки {record_type.__name__} {raw.get('id', 'unknown')}: {str(e)}")
+    return records
@@ -0,0 +1,143 @@
+import re
+import time
+from collections import deque
+from app.core import config
+
+# Границы корзин гистограмм (секунды): запросы - от миллисекунд, стадии и прогоны - до часа
+REQUEST_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+STAGE_BUCKETS = (0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = labels
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = REQUEST_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = labels
+        self.buckets = buckets
+        # labels -> [счётчики по корзинам..., сумма, количество]
+        self._values = {}
+
+    def observe(self, value: float, *labels):
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._values.items()):
+            bounds = [f'le="{bound}"' for bound in self.buckets] + ['le="+Inf"']
+            for bound, count in zip(bounds, series[:-2] + [series[-1]]):
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, bound)} {count}")
+            plain = _labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{plain} {round(series[-2], 6)}")
+            lines.append(f"{self.name}_count{plain} {series[-1]}")
+        return lines
+
+# ID в путях МойСклад (UUID) заменяем, чтобы не плодить серии на каждую сущность
+_UUID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+_API_PREFIX = re.compile(r"^/api/remap/[^/]+")
+
+def endpoint_label(path: str) -> str:
+    return _UUID.sub(":id", _API_PREFIX.sub("", path)) or "/"
+
+class Metrics:
+    """
+    Метрики синхронизации в памяти процесса: счётчики и гистограммы в формате
+    Prometheus (GET /metrics) и сводки последних прогонов (GET /sync/runs).
+    Все обновления идут из цикла событий, поэтому блокировки не нужны.
+    """
+
+    def __init__(self, runs_keep: int = None):
+        self.ms_requests = Counter("ms_requests_total", "Запросы к МойСклад", ("endpoint", "status"))
+        self.ms_latency = Histogram(
+            "ms_request_seconds", "Время запросов к МойСклад", ("endpoint", "status")
+        )
+        self.supabase_latency = Histogram(
+            "supabase_write_seconds", "Время записи пачки в Supabase", ("table", "result")
+        )
+        self.rows = Counter(
+            "sync_rows_total", "Строки синхронизации по результату", ("table", "result")
+        )
+        self.image_bytes = Counter("image_bytes_total", "Байты изображений", ("direction",))
+        self.ms_rate_limit = Counter(
+            "ms_rate_limit_events_total", "Ограничитель запросов к МойСклад: запросы, ответы 429, повторы", ("event",)
+        )
+        self.stage_seconds = Histogram(
+            "sync_stage_seconds", "Время стадий синхронизации", ("run", "stage", "status"), STAGE_BUCKETS
+        )
+        self.run_seconds = Histogram(
+            "sync_run_seconds", "Время прогонов синхронизации", ("run", "status"), STAGE_BUCKETS
+        )
+        self._all = (
+            self.ms_requests, self.ms_latency, self.supabase_latency,
+            self.rows, self.image_bytes, self.ms_rate_limit, self.stage_seconds, self.run_seconds,
+        )
+        self.runs = deque(maxlen=runs_keep or config.METRICS_RUNS_KEEP)
+
+    def observe_ms_response(self, response, seconds: float):
+        endpoint = endpoint_label(response.request.url.path)
+        status = str(response.status_code)
+        self.ms_requests.inc(endpoint, status)
+        self.ms_latency.observe(seconds, endpoint, status)
+
+    def observe_ms_error(self, url_path: str, seconds: float):
+        # Сетевая ошибка: ответа нет, статус - "error"
+        endpoint = endpoint_label(url_path)
+        self.ms_requests.inc(endpoint, "error")
+        self.ms_latency.observe(seconds, endpoint, "error")
+
+    def record_run(self, run: str, started_at: float, status: str, details: dict = None):
+        """Сохраняет сводку прогона; started_at - time.time() начала прогона"""
+        seconds = round(time.time() - started_at, 3)
+        self.run_seconds.observe(seconds, run, status)
+        for stage, entry in (details or {}).get("stages", {}).items():
+            if "seconds" in entry:
+                self.stage_seconds.observe(entry["seconds"], run, stage, entry["status"])
+        self.runs.append({
+            "run": run,
+            "status": status,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started_at)),
+            "seconds": seconds,
+            **(details or {}),
+        })
+
+    def recent_runs(self, limit: int = None) -> list:
+        runs = list(self.runs)[::-1]
+        return runs[:limit] if limit else runs
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._all:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
@@ -1,144 +1,124 @@
-import httpx
-from app.db.supabase_client import supabase
+import asyncio
+from app.db.writer import BatchWriter
 from app.core import config
-from app.logger import logger
-from app.services.storage import upload_image
-from app.services.utils import get_headers, log_response_details
+from app.logger import logger, log_sampled
+from app.services.image_pipeline import ImagePipeline
+from app.services.image_cache import image_cache
+from app.services.mapping import Variant, map_rows
+from app.services.pagination import iter_batches, iter_rows
+from app.services.stock import try_load_stock_for, stock_tracker
+from app.services.product_index import product_ids
+from app.services.catalog import catalog_cache
+from app.services.fingerprints import fingerprint_store
+from app.services.sync_state import updated_since_params
+from app.services.reference import reference_cache
 
-async def sync_modifications(stores: dict):
+async def sync_modifications(stores: dict = None, stock_index: dict = None, updated_since: str = None,
+                             rows=None, products_done: asyncio.Event = None, products_ok=None,
+                             start_offset: int = 0, on_checkpoint=None, load_stock=None) -> bool:
+    """
+    products_done - событие окончания записи товаров этого прогона, products_ok -
+    функция без аргументов: успешно ли они записаны. Модификации, чей товар не
+    записан из-за сбоя товаров, - не чистый пропуск: прогон считается неудачным.
+    """
     try:
-        logger.info("Начинаем синхронизацию модификаций")
-        
-        headers = get_headers()
-        if not headers:
-            logger.error("Не удалось получить заголовки для запроса. Синхронизация прервана.")
-            return
+        logger.info(f"Начинаем синхронизацию модификаций{f' (изменённые с {updated_since})' if updated_since else ''}")
         
         # Используем полный URL с указанием API версии
         url = f"{config.MS_BASE_URL}/entity/variant"
         logger.info(f"Запрашиваем модификации: {url}")
-        
-        # Добавляем параметры запроса для пагинации и ограничения количества
-        params = {
-            "limit": 100
-        }
-        
-        response = httpx.get(url, headers=headers, params=params)
-        log_response_details(response, url)
-        
-        response.raise_for_status()
-        data = response.json()["rows"]
-        logger.info(f"Получено {len(data)} модификаций для обработки")
 
-        for i, mod in enumerate(data):
-            try:
-                # Получаем основную информацию о модификации
-                mod_name = mod.get('name', 'Без имени')
-                mod_id = mod.get('id', 'unknown')
-                logger.info(f"Обработка модификации {i+1}/{len(data)}: {mod_name} (ID: {mod_id})")
-                
-                # Проверяем существование товара в базе данных перед добавлением модификации
-                product_id = None
-                if "product" in mod and "meta" in mod["product"] and "href" in mod["product"]["meta"]:
-                    product_id = mod["product"]["meta"]["href"].split("/")[-1]
-                else:
-                    logger.warning(f"Модификация {mod_name} не содержит ссылки на товар. Пропускаем.")
-                    continue
-                
-                # Проверка существования товара в базе
-                product_exists = supabase.table("products").select("id").eq("id", product_id).execute()
-                
-                if not product_exists.data:
-                    logger.warning(f"Товар с ID {product_id} не найден в базе данных. Пропускаем модификацию {mod_name}.")
-                    continue
-                
-                # Получаем остатки по складам
-                stock_data = {}
-                try:
-                    stock_url = f"{config.MS_BASE_URL}/report/stock/bystore?filter=variant=https://api.moysklad.ru/api/remap/1.2/entity/variant/{mod_id}"
-                    logger.info(f"Запрашиваем остатки для модификации {mod_id}")
-                    stock_resp = httpx.get(stock_url, headers=headers)
-                    log_response_details(stock_resp, stock_url)
-                    
-                    # Log the stock response JSON for debugging
-                    stock_json = None
+        # Типы цен и склады - из кэша справочников
+        price_types = await reference_cache.get("price_types")
+        if stores is None:
+            stores = await reference_cache.get("stores")
+
+        # ID товаров загружаем один раз (или берём из только что прошедшей sync_products)
+        await product_ids.ensure_loaded()
+
+        processed = 0
+        # Модификации без товара собираем и сообщаем о них одной сводкой
+        orphans = []
+        # Из них - пропущенные только потому, что товары этого прогона не записались
+        deferred = 0
+        # Стадия изображений закрывается первой: дожидаемся загрузок, затем последняя пачка и правки полей изображения
+        # Продолжение прерванного прогона - как в sync_products
+        position = start_offset
+        async with BatchWriter(
+            "modifications", on_commit=[stock_tracker.observer("modifications"), catalog_cache.observer("modifications")],
+            fingerprints=fingerprint_store,
+            on_checkpoint=on_checkpoint,
+        ) as writer, ImagePipeline(writer) as images:
+            async for batch in iter_batches(rows or iter_rows(url, updated_since_params(updated_since))):
+                records = list(map_rows(batch, Variant, price_types))
+                # Без общего снимка - остатки только для модификаций пачки, как в sync_products
+                batch_stock = stock_index
+                if batch_stock is None:
+                    ids = [mod.id for mod in records if mod.product_id]
+                    if load_stock is not None:
+                        batch_stock = await load_stock(ids)
+                    else:
+                        batch_stock = await try_load_stock_for(stores, "variant", ids)
+                for mod in records:
                     try:
-                        stock_json = stock_resp.json()
-                        logger.debug(f"JSON ответа для остатков модификации {mod_id}: {stock_json}")
-                    except Exception as json_e:
-                        logger.error(f"Ошибка парсинга JSON остатков модификации {mod_id}: {json_e}")
-                        logger.error(f"Тело ответа (текст): {stock_resp.text}")
-                        stock_json = {} # Присваиваем пустой словарь, чтобы избежать падения
-                    
-                    stock_resp.raise_for_status()
+                        processed += 1
+                        log_sampled("modifications", "Обработка модификации {}: {} (ID: {})", processed, mod.name, mod.id)
 
-                    # --- ПРАВИЛЬНАЯ ЛОГИКА ОБРАБОТКИ ОСТАТКОВ (как в sync_products) ---
-                    for mod_stock_row in stock_json.get("rows", []):
-                        # Обрабатываем stockByStore (тип проверять не нужно, т.к. фильтр по variant)
-                        for store_stock_info in mod_stock_row.get("stockByStore", []):
-                            store_meta = store_stock_info.get("meta")
-                            if store_meta and store_meta.get("href"):
-                                store_id = store_meta["href"].split("/")[-1]
-                                if store_id in stores:
-                                    store_name = stores[store_id]
-                                    stock_value = store_stock_info.get("stock", 0.0)
-                                    stock_data[store_name] = stock_value
-                                    logger.debug(f"Найден остаток для модификации {mod_id} на складе '{store_name}' (ID: {store_id}): {stock_value}")
-                                else:
-                                    logger.warning(f"Склад с ID {store_id} из остатков модификации {mod_id} не найден в общем списке складов.")
-                            else:
-                                logger.warning(f"Отсутствует 'meta' или 'href' в данных остатка по складу для модификации {mod_id}: {store_stock_info}")
-                    # ------------------------------------------------------------------
+                        # Проверяем существование товара перед добавлением модификации
+                        if not mod.product_id:
+                            orphans.append((mod.id, None))
+                            continue
 
-                except Exception as e:
-                    logger.warning(f"Ошибка при получении остатков для модификации {mod_name}: {str(e)}")
+                        # Товары ещё пишутся параллельно: ждём их окончания, прежде чем считать модификацию сиротой
+                        if mod.product_id not in product_ids and products_done is not None and not products_done.is_set():
+                            await products_done.wait()
 
-                # Логируем итоговые остатки перед сохранением
-                logger.debug(f"Итоговые остатки для модификации {mod_id} перед сохранением: {stock_data}")
+                        # Проверка по индексу товаров в памяти вместо запроса к базе
+                        if mod.product_id not in product_ids:
+                            orphans.append((mod.id, mod.product_id))
+                            if products_ok is not None and not products_ok():
+                                # Контрольная точка не должна уйти дальше этой модификации:
+                                # продолженный прогон перечитает её, когда товары будут записаны
+                                writer.hold_marks()
+                                deferred += 1
+                            continue
 
-                # Получаем цены
-                prices = {}
-                if "salePrices" in mod and mod["salePrices"]:
-                    for p in mod.get("salePrices", []):
-                        try:
-                            price_type_href = p.get("priceType", {}).get("meta", {}).get("href")
-                            if price_type_href:
-                                price_type_id = price_type_href.split("/")[-1]
-                                prices[price_type_id] = p["value"] / 100
-                        except Exception as e:
-                            logger.warning(f"Ошибка при обработке цены модификации {mod_name}: {str(e)}")
+                        # Остатки по складам - из снимка прогона или загруженных для пачки (None - не загрузились)
+                        stock_data = batch_stock.get(mod.id, {})
+                        logger.debug("Итоговые остатки для модификации {} перед сохранением: {}", mod.id, stock_data)
 
-                # Загружаем изображение если оно есть
-                image_url = None
-                try:
-                    # Эта функция уже обрабатывает случай отсутствия изображений
-                    image_url = await upload_image(mod)
-                    if image_url:
-                        logger.info(f"Изображение для модификации {mod_name} успешно загружено")
-                    else:
-                        logger.info(f"Для модификации {mod_name} нет изображения или не удалось загрузить")
-                except Exception as e:
-                    logger.warning(f"Ошибка при загрузке изображения модификации {mod_name}: {str(e)}")
+                        # Известные URL изображения пишем сразу, загрузку нового отдаём стадии изображений
+                        image_item = mod.image_item()
+                        image, image_pending = images.resolve(image_item)
+
+                        await writer.add(mod.to_row(image, stock_data))
+
+                        if image_pending:
+                            await images.submit(image_item, image)
+
+                        logger.debug("Модификация {} поставлена в очередь на запись", mod.name)
+
+                    except Exception as e:
+                        logger.error(f"Ошибка при обработке модификации {mod.name}: {str(e)}")
+                        continue
+                position += len(batch)
+                writer.mark(position)
 
-                # Сохраняем в Supabase
-                characteristics = mod.get("characteristics", [])
-                
-                supabase.table("modifications").upsert({
-                    "id": mod_id,
-                    "product_id": product_id,
-                    "name": mod_name,
-                    "characteristics": characteristics,
-                    "image_url": image_url,
-                    "prices": prices,
-                    "stock": stock_data
-                }).execute()
-                
-                logger.info(f"Модификация {mod_name} успешно сохранена в базе")
-                
-            except Exception as e:
-                logger.error(f"Ошибка при обработке модификации {mod.get('name', 'Без имени')}: {str(e)}")
-                continue
+        if orphans:
+            sample = ", ".join(f"{mod_id} (товар {product_id})" for mod_id, product_id in orphans[:10])
+            logger.warning(f"Пропущено {len(orphans)} модификаций без товара в базе. Примеры: {sample}")
 
-        logger.info("Модификации синхронизированы успешно")
+        await asyncio.to_thread(image_cache.flush_touched)
+        image_cache.log_stats("Модификации")
+        if deferred:
+            # Отметку не двигаем: иначе следующий инкрементальный прогон эти модификации не запросит
+            logger.error(f"Модификации не синхронизированы: {deferred} пропущено из-за незаписанных товаров")
+            return False
+        if writer.failed:
+            logger.error(f"Модификации синхронизированы с ошибками: обработано {processed}, не записано {writer.failed}")
+            return False
+        logger.info(f"Модификации синхронизированы успешно: обработано {processed}")
+        return True
     except Exception as e:
         logger.error(f"Ошибка при синхронизации модификаций: {str(e)}")
+        return False
@@ -0,0 +1,163 @@
+import asyncio
+from app.core import config
+from app.logger import logger
+from app.services import json_stream
+from app.services.http_client import ms_get, ms_stream
+
+async def _fetch_page(url: str, params: dict) -> dict:
+    response = await ms_get(url, params=params)
+    response.raise_for_status()
+    return json_stream.loads(response.content)
+
+async def _iter_streamed_pages(url: str, base_params: dict, limit: int, start_offset: int, end_offset: int = None):
+    """
+    Потоковый режим iter_pages: страницы читаются последовательно, строки
+    разбираются прямо из потока байтов и отдаются пачками по MS_STREAM_CHUNK_ROWS.
+    Конец коллекции - первая неполная страница, meta.size не нужен.
+    """
+    chunk_size = config.MS_STREAM_CHUNK_ROWS
+    offset = start_offset
+    while end_offset is None or offset < end_offset:
+        page_limit = limit if end_offset is None else min(limit, end_offset - offset)
+        count = 0
+        chunk = []
+        async with ms_stream(url, {**base_params, "limit": page_limit, "offset": offset}) as response:
+            response.raise_for_status()
+            async for row in json_stream.iter_stream_items(response):
+                count += 1
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+        if count < page_limit:
+            return
+        offset += page_limit
+
+async def iter_pages(url: str, params: dict = None, limit: int = None,
+                     concurrency: int = None, start_offset: int = 0, end_offset: int = None):
+    """
+    Асинхронный итератор по страницам коллекции МойСклад (entity/*, report/*).
+    Первая страница читается сразу, по meta.size вычисляются оставшиеся offset'ы,
+    и они запрашиваются параллельно (не более concurrency одновременно).
+    Страницы отдаются строго по порядку offset'ов, но скачиваются с опережением,
+    так что обработка первой страницы начинается до прихода последней.
+    Если meta.size в ответе нет, идём последовательно по meta.nextHref.
+    При MS_STREAM_JSON страницы разбираются потоково (см. _iter_streamed_pages)
+    и отдаются частями, а не целиком. end_offset ограничивает диапазон строк
+    [start_offset, end_offset) - для обработки коллекции по частям.
+    """
+    limit = limit or config.MS_PAGE_LIMIT
+    concurrency = max(1, concurrency or config.MS_PAGE_CONCURRENCY)
+    base_params = dict(params or {})
+
+    def page_params(offset):
+        page_limit = limit if end_offset is None else min(limit, end_offset - offset)
+        return {**base_params, "limit": page_limit, "offset": offset}
+
+    logger.info(f"Запрашиваем {url}: offset={start_offset}, limit={limit}")
+    if json_stream.streaming_enabled():
+        async for rows in _iter_streamed_pages(url, base_params, limit, start_offset, end_offset):
+            yield rows
+        return
+
+    first = await _fetch_page(url, page_params(start_offset))
+    rows = first.get("rows", [])
+    yield rows
+
+    meta = first.get("meta", {})
+    total = meta.get("size")
+
+    if total is None:
+        # Коллекция без meta.size: единственный способ - идти по nextHref
+        next_href = meta.get("nextHref")
+        while next_href:
+            logger.debug("Запрашиваем следующую страницу: {}", next_href)
+            page = await _fetch_page(next_href, None)
+            yield page.get("rows", [])
+            next_href = page.get("meta", {}).get("nextHref")
+        return
+
+    if end_offset is not None:
+        total = min(total, end_offset)
+    offsets = iter(range(start_offset + limit, total, limit))
+    logger.info(f"{url}: всего {total} строк")
+
+    # Скользящее окно задач: держим в работе до concurrency страниц вперёд
+    pending = []
+    try:
+        for offset in offsets:
+            pending.append(asyncio.create_task(_fetch_page(url, page_params(offset))))
+            if len(pending) >= concurrency:
+                break
+        while pending:
+            page = await pending.pop(0)
+            next_offset = next(offsets, None)
+            if next_offset is not None:
+                pending.append(asyncio.create_task(_fetch_page(url, page_params(next_offset))))
+            yield page.get("rows", [])
+    finally:
+        # Если потребитель прервал итерацию, не оставляем висящих запросов
+        for task in pending:
+            task.cancel()
+
+async def collection_size(url: str, params: dict = None) -> int:
+    """Число строк коллекции (meta.size) одним запросом с limit=1"""
+    page = await _fetch_page(url, {**(params or {}), "limit": 1, "offset": 0})
+    return page.get("meta", {}).get("size", 0)
+
+async def iter_rows(url: str, params: dict = None, **kwargs):
+    """То же, что iter_pages, но отдаёт строки по одной"""
+    async for rows in iter_pages(url, params, **kwargs):
+        for row in rows:
+            yield row
+
+async def iter_batches(rows, size: int = 100):
+    """Собирает строки асинхронного итератора в списки по size - для пакетного map_rows"""
+    batch = []
+    async for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class PrefetchedRows:
+    """
+    Начинает качать страницы коллекции сразу при создании, в фоне, и держит
+    не больше max_pages готовых страниц. Итерируется по строкам. Нужен, чтобы
+    стадия могла скачивать данные, пока ждёт свои зависимости.
+    """
+
+    _END = object()
+
+    def __init__(self, url: str, params: dict = None, max_pages: int = None, start_offset: int = 0):
+        self._queue = asyncio.Queue(maxsize=max_pages or config.MS_PREFETCH_PAGES)
+        self._task = asyncio.create_task(self._pump(url, params, start_offset))
+
+    async def _pump(self, url, params, start_offset):
+        try:
+            async for rows in iter_pages(url, params, start_offset=start_offset):
+                await self._queue.put(rows)
+        except Exception as e:
+            await self._queue.put(e)
+            return
+        await self._queue.put(self._END)
+
+    async def __aiter__(self):
+        try:
+            while True:
+                page = await self._queue.get()
+                if page is self._END:
+                    return
+                if isinstance(page, Exception):
+                    raise page
+                for row in page:
+                    yield row
+        finally:
+            self._task.cancel()
+
+    def cancel(self):
+        self._task.cancel()
@@ -0,0 +1,47 @@
+from app.db.reader import iter_table_pages
+from app.logger import logger
+
+class ProductIndex:
+    """
+    Множество ID товаров, уже записанных в Supabase. Нужно модификациям для
+    проверки внешнего ключа product_id без отдельного SELECT на каждую строку.
+    Загружается одним постраничным запросом или берётся из результатов
+    sync_products и пополняется по мере записи товаров.
+    """
+
+    def __init__(self):
+        self._ids = set()
+        self.loaded = False
+
+    def __contains__(self, product_id) -> bool:
+        return product_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add_rows(self, rows: list):
+        # Используется как on_commit у BatchWriter("products")
+        self._ids.update(row["id"] for row in rows)
+
+    def discard(self, ids: list):
+        # Товары удалены из Supabase (вебхук DELETE)
+        self._ids.difference_update(ids)
+
+    def mark_loaded(self):
+        # Полный проход sync_products записал все товары - индекс можно считать полным
+        self.loaded = True
+
+    async def load(self):
+        logger.info("Загружаем ID товаров из Supabase")
+        ids = set()
+        async for page in iter_table_pages("products", "id"):
+            ids.update(row["id"] for row in page)
+        self._ids |= ids
+        self.loaded = True
+        logger.info(f"Индекс товаров загружен: {len(self._ids)} ID")
+
+    async def ensure_loaded(self):
+        if not self.loaded:
+            await self.load()
+
+product_ids = ProductIndex()
@@ -0,0 +1,114 @@
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from app.core import config
+from app.logger import logger
+from app.services.metrics import metrics
+
+class RateLimiter:
+    """
+    Общий для всех запросов к МойСклад ограничитель: token bucket
+    (rate запросов за period секунд) плюс лимит параллельных запросов.
+    По заголовкам ответа X-RateLimit-Remaining и X-Lognex-Retry-TimeInterval
+    ограничитель притормаживает всех клиентов заранее, не дожидаясь 429.
+    """
+
+    def __init__(self, rate: int = None, period: float = None, max_concurrent: int = None):
+        self.capacity = rate or config.MS_RATE_LIMIT
+        self.period = period or config.MS_RATE_PERIOD
+        self.fill_rate = self.capacity / self.period
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(max_concurrent or config.MS_MAX_CONCURRENT)
+        # До этого момента (time.monotonic) новые запросы не отправляются
+        self._pause_until = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self.retried = 0
+
+    async def _take_token(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._pause_until:
+                    await asyncio.sleep(self._pause_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.fill_rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.fill_rate)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Ожидает токен и свободный слот параллельности на время одного запроса"""
+        async with self._semaphore:
+            await self._take_token()
+            self.requests += 1
+            metrics.ms_rate_limit.inc("requests")
+            yield
+
+    def pause(self, seconds: float):
+        self._pause_until = max(self._pause_until, time.monotonic() + seconds)
+
+    def observe(self, response):
+        """Подстраивает темп по заголовкам лимитов МойСклад"""
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        if remaining is not None:
+            try:
+                remaining = int(remaining)
+            except ValueError:
+                remaining = None
+        if remaining is not None:
+            # Окно почти исчерпано: не отдаём оставшиеся токены разом
+            self._tokens = min(self._tokens, remaining)
+            if remaining <= 1:
+                self.pause(self.period / self.capacity)
+
+        if response.status_code == 429:
+            self.throttled += 1
+            metrics.ms_rate_limit.inc("throttled")
+            self.pause(self.retry_after(response) or self.period)
+
+    @staticmethod
+    def retry_after(response) -> float:
+        # X-Lognex-Retry-TimeInterval - через сколько миллисекунд можно повторить запрос
+        interval = response.headers.get("X-Lognex-Retry-TimeInterval")
+        if interval:
+            try:
+                return int(interval) / 1000
+            except ValueError:
+                pass
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return None
+
+    def backoff(self, attempt: int, response=None) -> float:
+        """Экспоненциальная задержка с джиттером, не меньше подсказки сервера"""
+        delay = min(config.MS_BACKOFF_MAX, config.MS_BACKOFF_BASE * (2 ** attempt))
+        delay *= random.uniform(0.5, 1.5)
+        if response is not None:
+            delay = max(delay, self.retry_after(response) or 0)
+        return delay
+
+    def record_retry(self):
+        self.retried += 1
+        metrics.ms_rate_limit.inc("retried")
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "throttled": self.throttled, "retried": self.retried}
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(
+            f"Запросы к МойСклад: всего {stats['requests']}, получено 429: {stats['throttled']}, повторов: {stats['retried']}"
+        )
+
+rate_limiter = RateLimiter()
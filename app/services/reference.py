@@ -0,0 +1,106 @@
+import asyncio
+import json
+import os
+import time
+from app.core import config
+from app.logger import logger
+from app.services import stores as stores_service
+from app.services.http_client import ms_get
+
+async def _load_price_types() -> dict:
+    url = f"{config.MS_BASE_URL}/context/companysettings/pricetype"
+    response = await ms_get(url)
+    response.raise_for_status()
+    # API возвращает список напрямую, а не словарь с ключом "rows"
+    return {p["id"]: p["name"] for p in response.json()}
+
+class ReferenceCache:
+    """
+    Кэш справочников МойСклад (типы цен, склады) в виде
+    {ID: название}. Записи живут ttl секунд: устаревший справочник отдаётся
+    сразу, а обновляется в фоне; если справочника нет совсем, загрузка
+    ожидается. Снимок сохраняется на диск, чтобы после перезапуска не
+    ходить в МойСклад до истечения TTL.
+    """
+
+    LOADERS = {
+        "price_types": _load_price_types,
+        "stores": stores_service.load_stores,
+    }
+
+    def __init__(self, ttl: float = None, snapshot_name: str = "reference_snapshot.json"):
+        self.ttl = ttl or config.REFERENCE_TTL_SECONDS
+        self.max_stale = max(self.ttl, config.REFERENCE_MAX_STALE_SECONDS)
+        self._snapshot_path = os.path.join(config.DATA_DIR, snapshot_name)
+        # kind -> (время загрузки по time.time(), {ID: название})
+        self._entries = {}
+        self._locks = {kind: asyncio.Lock() for kind in self.LOADERS}
+        self._background = {}
+        self._load_snapshot()
+
+    def _load_snapshot(self):
+        try:
+            with open(self._snapshot_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать снимок справочников: {str(e)}")
+            return
+        for kind, entry in snapshot.items():
+            if kind in self.LOADERS:
+                self._entries[kind] = (entry["loaded_at"], entry["data"])
+        logger.info(f"Справочники загружены из снимка: {', '.join(self._entries)}")
+
+    def _write_snapshot(self, snapshot: dict):
+        os.makedirs(config.DATA_DIR, exist_ok=True)
+        tmp_path = f"{self._snapshot_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, self._snapshot_path)
+
+    def _expired(self, kind: str) -> bool:
+        loaded_at, _ = self._entries[kind]
+        return time.time() - loaded_at >= self.ttl
+
+    async def refresh(self, kind: str) -> dict:
+        async with self._locks[kind]:
+            data = await self.LOADERS[kind]()
+            self._entries[kind] = (time.time(), data)
+        logger.info(f"Справочник {kind} обновлён: {len(data)} записей")
+        snapshot = {name: {"loaded_at": loaded_at, "data": entry} for name, (loaded_at, entry) in self._entries.items()}
+        try:
+            await asyncio.to_thread(self._write_snapshot, snapshot)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить снимок справочников: {str(e)}")
+        return data
+
+    def _refresh_in_background(self, kind: str):
+        task = self._background.get(kind)
+        if task is None or task.done():
+            self._background[kind] = asyncio.create_task(self._safe_refresh(kind))
+
+    async def _safe_refresh(self, kind: str):
+        try:
+            await self.refresh(kind)
+        except Exception as e:
+            logger.error(f"Ошибка фонового обновления справочника {kind}: {str(e)}")
+
+    async def get(self, kind: str) -> dict:
+        if kind in self._entries and time.time() - self._entries[kind][0] >= self.max_stale:
+            # Слишком старый справочник (например, из давнего снимка) не отдаём даже временно
+            self._entries.pop(kind)
+        if kind not in self._entries:
+            return await self.refresh(kind)
+        if self._expired(kind):
+            self._refresh_in_background(kind)
+        return self._entries[kind][1]
+
+    def invalidate(self, kind: str = None):
+        """Сбрасывает один справочник или все: следующий get загрузит их заново"""
+        kinds = [kind] if kind else list(self._entries)
+        for name in kinds:
+            self._entries.pop(name, None)
+        logger.info(f"Справочники сброшены: {', '.join(kinds) or '-'}")
+
+reference_cache = ReferenceCache()
@@ -0,0 +1,153 @@
+import asyncio
+import time
+from app.core import config
+from app.logger import logger
+from app.services import categories, products, modifications, stock, sync_state
+from app.services.coordinator import get_coordinator
+from app.services.pagination import collection_size, iter_rows
+from app.services.product_index import product_ids
+from app.services.reference import reference_cache
+
+# Коллекции МойСклад, которые делятся на разделы по диапазонам строк
+COLLECTIONS = {
+    "stock": "report/stock/bystore",
+    "products": "entity/product",
+    "variants": "entity/variant",
+}
+
+# --- Лидер: планирование прогона и ожидание его окончания ---
+
+async def plan_full_sync(watermark: str) -> str:
+    """
+    Делит полную синхронизацию на разделы по SHARD_PARTITION_ROWS строк.
+    Категорий немного - они идут одним разделом; изображения грузятся
+    воркером вместе со строками своего раздела.
+    """
+    partitions = [("categories", 0, 0)]
+    for entity, path in COLLECTIONS.items():
+        size = await collection_size(f"{config.MS_BASE_URL}/{path}")
+        step = config.SHARD_PARTITION_ROWS
+        partitions.extend((entity, start, min(start + step, size)) for start in range(0, size, step))
+    coordinator = get_coordinator()
+    run_id = await asyncio.to_thread(coordinator.plan_run, watermark, partitions)
+    logger.info(f"Распределённый прогон {run_id}: {len(partitions)} разделов")
+    return run_id
+
+# Лидер ждёт прогон без sync_lock: параллельные вызовы не должны спланировать два прогона
+_plan_lock = asyncio.Lock()
+
+async def run_sharded_full_sync() -> dict:
+    """
+    Полная синхронизация силами воркеров (python -m app.worker): лидер только
+    планирует разделы и ждёт их выполнения, затем сохраняет отметки. Если
+    прогон уже идёт (например, после смены лидера), ждём его, а не создаём новый.
+    """
+    async with _plan_lock:
+        return await _run_sharded_full_sync()
+
+async def _run_sharded_full_sync() -> dict:
+    coordinator = get_coordinator()
+    run = await asyncio.to_thread(coordinator.active_run)
+    if run:
+        run_id, watermark = run["run_id"], run["watermark"]
+        logger.info(f"Продолжаем ожидать распределённый прогон {run_id}")
+    else:
+        watermark = sync_state.now_watermark()
+        run_id = await plan_full_sync(watermark)
+
+    while True:
+        progress = await asyncio.to_thread(coordinator.run_progress, run_id)
+        if not progress.get("pending") and not progress.get("leased"):
+            break
+        await asyncio.sleep(config.SHARD_POLL_SECONDS)
+
+    status = "failed" if progress.get("failed") else "ok"
+    await asyncio.to_thread(coordinator.finish_run, run_id, status)
+    if status == "ok":
+        for entity in ("categories", "products", "modifications"):
+            await sync_state.set_watermark(entity, watermark)
+    else:
+        logger.warning(f"Распределённый прогон {run_id}: не выполнено разделов {progress['failed']}, отметки не обновлены")
+    logger.info(f"Распределённый прогон {run_id} завершён: {progress}")
+    return {"run_id": run_id, "status": status, "partitions": progress}
+
+# --- Воркер: выполнение разделов ---
+
+async def _process(part: dict) -> bool:
+    coordinator = get_coordinator()
+    entity, start, stop = part["entity"], part["start"], part["stop"]
+    if entity == "categories":
+        return await categories.sync_categories()
+
+    stores = await reference_cache.get("stores")
+    url = f"{config.MS_BASE_URL}/{COLLECTIONS[entity]}"
+    if entity == "stock":
+        async for page in stock.iter_stock_pages(stores, start_offset=start, end_offset=stop):
+            await asyncio.to_thread(coordinator.save_stock, part["run_id"], page)
+        return True
+
+    # Остатки - из снимка, собранного разделами фазы stock этого прогона, одним запросом на пачку
+    def load_stock(ids: list):
+        return asyncio.to_thread(coordinator.stock_for, part["run_id"], ids)
+
+    rows = iter_rows(url, start_offset=start, end_offset=stop)
+    if entity == "products":
+        return await products.sync_products(stores, rows=rows, load_stock=load_stock)
+    # Товары фазы products записаны другими воркерами - перечитываем индекс один раз на прогон
+    if _index_run.get("run_id") != part["run_id"]:
+        await product_ids.load()
+        _index_run["run_id"] = part["run_id"]
+    return await modifications.sync_modifications(stores, rows=rows, load_stock=load_stock)
+
+# Прогон, для которого индекс товаров уже перечитан
+_index_run = {}
+
+async def _renew(part: dict, work: asyncio.Task) -> bool:
+    """Продлевает аренду, пока идёт work; если аренда потеряна, отменяет work и возвращает True"""
+    coordinator = get_coordinator()
+    while True:
+        await asyncio.sleep(coordinator.lease_seconds / 3)
+        try:
+            renewed = await asyncio.to_thread(coordinator.renew, part)
+        except Exception as e:
+            logger.error(f"Ошибка при продлении аренды раздела {part['part_id']}: {str(e)}")
+            continue
+        if not renewed:
+            # Раздел уже мог достаться другому воркеру - дальше его не пишем
+            logger.warning(f"Аренда раздела {part['part_id']} потеряна, раздел прерван")
+            work.cancel()
+            return True
+
+async def run_worker():
+    """Бесконечный цикл воркера: взять раздел в аренду, выполнить, отметить"""
+    coordinator = get_coordinator()
+    logger.info(f"Воркер {coordinator.owner} запущен")
+    while True:
+        try:
+            part = await asyncio.to_thread(coordinator.claim)
+        except Exception as e:
+            logger.error(f"Ошибка при получении раздела: {str(e)}")
+            part = None
+        if part is None:
+            await asyncio.sleep(config.SHARD_POLL_SECONDS)
+            continue
+
+        logger.info(f"Раздел {part['part_id']} ({part['entity']} {part['start']}-{part['stop']}), попытка {part['attempt']}")
+        started = time.monotonic()
+        work = asyncio.create_task(_process(part))
+        renewal = asyncio.create_task(_renew(part, work))
+        try:
+            success = await work
+        except asyncio.CancelledError:
+            # Отменён сам воркер (остановка) - пробрасываем; аренда потеряна - раздел не отмечаем,
+            # он уже у другого воркера
+            if not (renewal.done() and not renewal.cancelled() and renewal.result()):
+                raise
+            continue
+        except Exception as e:
+            logger.error(f"Ошибка в разделе {part['part_id']}: {str(e)}")
+            success = False
+        finally:
+            renewal.cancel()
+        await asyncio.to_thread(coordinator.complete, part, success)
+        logger.info(f"Раздел {part['part_id']} {'выполнен' if success else 'не выполнен'} за {time.monotonic() - started:.1f} с")
@@ -0,0 +1,87 @@
+import asyncio
+import time
+from app.logger import logger
+
+class StageGraph:
+    """
+    Небольшой исполнитель графа стадий синхронизации. Каждая стадия - корутина,
+    которая стартует, как только завершились все её зависимости; независимые
+    стадии выполняются одновременно. Если зависимость упала, стадия
+    пропускается. После прогона доступен отчёт с временем каждой стадии и
+    критическим путём.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._stages = {}
+        self._done = {}
+        self.results = {}
+        self.report = {}
+
+    def add(self, name: str, func, deps=()):
+        """func(results) -> результат стадии; results - результаты уже завершённых стадий"""
+        self._stages[name] = (func, tuple(deps))
+        self._done[name] = asyncio.Event()
+
+    def done_event(self, name: str) -> asyncio.Event:
+        # Для стадий, которым нужен не весь результат зависимости, а только момент её окончания
+        return self._done[name]
+
+    async def _run_stage(self, name: str, started_at: float):
+        func, deps = self._stages[name]
+        entry = {"deps": list(deps), "status": "pending"}
+        self.report[name] = entry
+        try:
+            for dep in deps:
+                await self._done[dep].wait()
+            failed = [dep for dep in deps if self.report[dep]["status"] != "ok"]
+            if failed:
+                entry["status"] = "skipped"
+                logger.warning(f"[{self.name}] Стадия {name} пропущена: не выполнены {failed}")
+                return
+
+            entry["start"] = round(time.monotonic() - started_at, 3)
+            try:
+                self.results[name] = await func(self.results)
+                entry["status"] = "ok"
+            except Exception as e:
+                entry["status"] = "failed"
+                entry["error"] = str(e)
+                logger.error(f"[{self.name}] Ошибка на стадии {name}: {str(e)}")
+            entry["end"] = round(time.monotonic() - started_at, 3)
+            entry["seconds"] = round(entry["end"] - entry["start"], 3)
+        finally:
+            self._done[name].set()
+
+    def _critical_path(self) -> list:
+        # Идём назад от стадии, закончившейся последней, по самой поздней зависимости
+        finished = {name: entry for name, entry in self.report.items() if "end" in entry}
+        if not finished:
+            return []
+        current = max(finished, key=lambda name: finished[name]["end"])
+        path = [current]
+        while True:
+            deps = [dep for dep in finished[current]["deps"] if dep in finished]
+            if not deps:
+                break
+            current = max(deps, key=lambda dep: finished[dep]["end"])
+            path.append(current)
+        return list(reversed(path))
+
+    async def run(self) -> dict:
+        started_at = time.monotonic()
+        await asyncio.gather(*(self._run_stage(name, started_at) for name in self._stages))
+        total = round(time.monotonic() - started_at, 3)
+        critical_path = self._critical_path()
+
+        summary = ", ".join(
+            f"{name}={entry.get('seconds', '-')}с ({entry['status']})" for name, entry in self.report.items()
+        )
+        logger.info(f"[{self.name}] Завершено за {total} с: {summary}")
+        logger.info(f"[{self.name}] Критический путь: {' -> '.join(critical_path)}")
+        return {
+            "name": self.name,
+            "seconds": total,
+            "stages": self.report,
+            "critical_path": critical_path,
+        }
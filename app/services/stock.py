@@ -0,0 +1,181 @@
+import asyncio
+import time
+from app.core import config
+from app.core.scheduler import exclusive
+from app.db.reader import iter_table_pages
+from app.db.supabase_client import supabase
+from app.logger import logger
+from app.services.catalog import catalog_cache
+from app.services.fingerprints import fingerprint_store
+from app.services.mapping import StockEntry, map_rows
+from app.services.metrics import metrics
+from app.services.pagination import iter_pages
+from app.services.reference import reference_cache
+
+async def iter_stock_pages(stores: dict, assortment_ids: set = None, params: dict = None, **kwargs):
+    """
+    Потоковый режим: постранично читает отчёт report/stock/bystore и отдаёт
+    остатки по одной странице в виде {ID товара/модификации: {склад: остаток}}.
+    В памяти держится только текущая страница. Если передан assortment_ids,
+    в результат попадают только указанные ID.
+    """
+    url = f"{config.MS_BASE_URL}/report/stock/bystore"
+    async for rows in iter_pages(url, params, limit=config.STOCK_PAGE_LIMIT, **kwargs):
+        page = {}
+        for entry in map_rows(rows, StockEntry, stores):
+            if not entry.id:
+                continue
+            if assortment_ids is not None and entry.id not in assortment_ids:
+                continue
+            page[entry.id] = entry.stock
+        yield page
+
+async def load_stock_index(stores: dict, assortment_ids: set = None) -> dict:
+    """Загружает весь отчёт об остатках и строит индекс {ID: {склад: остаток}}"""
+    logger.info("Загружаем снимок остатков по складам")
+    stock_index = {}
+    async for page in iter_stock_pages(stores, assortment_ids):
+        stock_index.update(page)
+    logger.info(f"Снимок остатков загружен: {len(stock_index)} позиций")
+    return stock_index
+
+class _NoStock:
+    """
+    Остатки не загрузились: .get() для любого ID отдаёт None, и строка пишется
+    без колонки stock - в базе остаются прежние остатки, а не пустые {}.
+    """
+
+    def get(self, row_id, default=None):
+        return None
+
+NO_STOCK = _NoStock()
+
+async def try_load_stock_index(stores: dict):
+    # Ошибка загрузки остатков не должна останавливать синхронизацию каталога, но и стирать
+    # остатки всего каталога тоже: строки пишутся без колонки stock (NO_STOCK)
+    try:
+        return await load_stock_index(stores)
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке снимка остатков: {str(e)}")
+        return NO_STOCK
+
+async def load_stock_for(stores: dict, entity_type: str, ids: list) -> dict:
+    """
+    Остатки только для перечисленных товаров или модификаций (entity_type -
+    product или variant): запросы с фильтром по STOCK_FILTER_CHUNK_SIZE
+    позиций вместо всего отчёта.
+    """
+    stock_index = {}
+    step = config.STOCK_FILTER_CHUNK_SIZE
+    for start in range(0, len(ids), step):
+        chunk = ids[start:start + step]
+        hrefs = ";".join(f"{entity_type}={config.MS_BASE_URL}/entity/{entity_type}/{item_id}" for item_id in chunk)
+        async for page in iter_stock_pages(stores, set(chunk), {"filter": hrefs}):
+            stock_index.update(page)
+    return stock_index
+
+async def try_load_stock_for(stores: dict, entity_type: str, ids: list):
+    # Ошибка остатков не останавливает синхронизацию каталога: строки пишутся без колонки stock
+    try:
+        return await load_stock_for(stores, entity_type, ids)
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке остатков {entity_type} для {len(ids)} позиций: {str(e)}")
+        return NO_STOCK
+
+class StockTracker:
+    """
+    Последние записанные в Supabase остатки: ID -> (таблица, остатки).
+    Нужен быстрому обновлению остатков, чтобы писать только изменившиеся
+    строки. Заполняется из базы при первом обновлении и поддерживается
+    в актуальном состоянии всеми записями товаров и модификаций.
+    """
+
+    TABLES = ("products", "modifications")
+
+    def __init__(self):
+        self._stock = {}
+        self.loaded = False
+
+    def observer(self, table: str):
+        # on_commit для BatchWriter: запоминаем записанные остатки
+        def observe(rows: list):
+            for row in rows:
+                if "stock" in row:
+                    self._stock[row["id"]] = (table, row["stock"] or {})
+        return observe
+
+    async def ensure_loaded(self):
+        if self.loaded:
+            return
+        for table in self.TABLES:
+            async for page in iter_table_pages(table, "id,stock"):
+                for row in page:
+                    self._stock.setdefault(row["id"], (table, row.get("stock") or {}))
+        self.loaded = True
+        logger.info(f"Трекер остатков загружен: {len(self._stock)} строк")
+
+    def diff(self, stock_index: dict) -> list:
+        """Строки, остатки которых отличаются от записанных: [(таблица, ID, остатки)]"""
+        changed = []
+        for row_id, (table, current) in self._stock.items():
+            # Позиции, пропавшие из отчёта, sync_products/sync_modifications тоже пишут как {}
+            fresh = stock_index.get(row_id, {})
+            if fresh != current:
+                changed.append((table, row_id, fresh))
+        return changed
+
+    def forget(self, ids: list):
+        # Удалённые строки: обновлять их остатки больше нечего
+        for row_id in ids:
+            self._stock.pop(row_id, None)
+
+    def remember(self, table: str, row_id: str, stock_data: dict):
+        self._stock[row_id] = (table, stock_data)
+
+stock_tracker = StockTracker()
+
+async def _write_stock(table: str, row_id: str, stock_data: dict, semaphore: asyncio.Semaphore) -> bool:
+    async with semaphore:
+        try:
+            query = supabase.table(table).update({"stock": stock_data}).eq("id", row_id)
+            await asyncio.to_thread(query.execute)
+        except Exception as e:
+            logger.error(f"Не удалось обновить остатки {table} {row_id}: {str(e)}")
+            return False
+    stock_tracker.remember(table, row_id, stock_data)
+    catalog_cache.record(table, [{"id": row_id, "stock": stock_data}])
+    return True
+
+@exclusive(wait=False)
+async def refresh_stock() -> dict:
+    """
+    Быстрое обновление остатков отдельно от полной синхронизации: один
+    снимок отчёта об остатках и UPDATE только колонки stock у строк,
+    где остатки действительно изменились.
+    """
+    logger.info("Запуск быстрого обновления остатков")
+    started_at = time.time()
+    await stock_tracker.ensure_loaded()
+    stores = await reference_cache.get("stores")
+    stock_index = await load_stock_index(stores)
+
+    changed = stock_tracker.diff(stock_index)
+    semaphore = asyncio.Semaphore(config.STOCK_WRITE_CONCURRENCY)
+    results = await asyncio.gather(
+        *(_write_stock(table, row_id, stock_data, semaphore) for table, row_id, stock_data in changed)
+    )
+    written = sum(1 for ok in results if ok)
+    # UPDATE только остатков делает отпечатки этих строк неверными: иначе следующая синхронизация
+    # пропустила бы строку, совпавшую со старым отпечатком, и в базе остались бы остатки из этого обновления
+    for table in stock_tracker.TABLES:
+        ids = [row_id for (row_table, row_id, _), ok in zip(changed, results) if ok and row_table == table]
+        if ids:
+            await asyncio.to_thread(fingerprint_store.forget, table, ids)
+    summary = {"checked": len(stock_index), "changed": len(changed), "written": written}
+    metrics.rows.inc("stock", "written", amount=written)
+    metrics.rows.inc("stock", "failed", amount=len(changed) - written)
+    metrics.record_run("stock", started_at, "ok" if written == len(changed) else "failed", summary)
+    if written:
+        catalog_cache.request_update()
+    logger.info(f"Остатки обновлены: {summary}")
+    return summary
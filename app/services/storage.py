@@ -1,46 +1,97 @@
-import httpx
+import asyncio
 from app.db.supabase_client import supabase
 from app.core import config
-from app.logger import logger
-from app.services.utils import get_headers, log_response_details
+from app.logger import logger, log_sampled
+from app.services.http_client import ms_get
+from app.services.image_cache import image_cache
+from app.services.metrics import metrics
+from app.services import transcode
 
-async def upload_image(item):
+async def _upload(file_name: str, data: bytes, content_type: str) -> str:
+    await asyncio.to_thread(
+        supabase.storage.from_(config.SUPABASE_STORAGE_BUCKET).upload,
+        file_name,
+        data,
+        # upsert: изменённое изображение перезаписывает старый файл
+        {"content-type": content_type, "upsert": "true"}
+    )
+    metrics.image_bytes.inc("upload", amount=len(data))
+    return f"{config.SUPABASE_URL}/storage/v1/object/public/{config.SUPABASE_STORAGE_BUCKET}/{file_name}"
+
+async def upload_image(item, check_cache: bool = True):
+    """
+    Загружает изображение элемента в Supabase Storage. Возвращает поля
+    изображения для строки (image_url, при перекодировании - и image_variants)
+    или None.
+    """
     try:
         if not item.get("images") or not item["images"]["meta"]["size"] > 0:
-            logger.debug(f"У элемента {item.get('id')} нет изображений")
+            logger.debug("У элемента {} нет изображений", item.get('id'))
             return None
             
         img_meta = item["images"]["rows"][0]
+
+        # Изображение не менялось с прошлой загрузки - берём URL из манифеста без скачивания
+        cached = image_cache.lookup(item["id"], img_meta) if check_cache else None
+        if cached:
+            logger.debug("Изображение {} не изменилось, используем {}", item['id'], cached["image_url"])
+            return cached
+
         url = img_meta["meta"]["downloadHref"]
-        logger.info(f"Загрузка изображения из {url}")
+        logger.debug("Загрузка изображения из {}", url)
         
-        headers = get_headers()
-        if not headers:
-            logger.error("Не удалось получить заголовки для запроса изображения")
-            return None
-            
-        response = httpx.get(url, headers=headers)
-        log_response_details(response, url)
+        # downloadHref отдаёт редирект на файловое хранилище МойСклад
+        response = await ms_get(url, follow_redirects=True)
         
         if response.status_code != 200:
             logger.error(f"Не удалось загрузить изображение: {response.status_code}")
             return None
             
         image_data = response.content
+        metrics.image_bytes.inc("download", amount=len(image_data))
+        # Хэширование мегабайтных файлов - CPU-работа, не держим ею цикл событий
+        content_hash = await asyncio.to_thread(image_cache.content_hash, image_data)
+
+        # Изменились только метаданные, содержимое то же - загружать в Storage не нужно
+        cached = image_cache.same_content(item["id"], content_hash)
+        if cached:
+            await asyncio.to_thread(
+                image_cache.store, item["id"], img_meta, content_hash,
+                cached["image_url"], cached.get("image_variants"),
+            )
+            return cached
+
+        variants = None
+        if transcode.enabled():
+            try:
+                variants = await transcode.transcode(image_data)
+            except Exception as e:
+                # Битое или неподдерживаемое изображение загружаем как есть
+                logger.error(f"Ошибка при перекодировании изображения {item['id']}: {str(e)}")
 
-        file_name = f"{item['id']}.jpg"
-        logger.info(f"Загрузка файла {file_name} в Supabase Storage")
-        
         # Добавляем обработку возможных ошибок при загрузке в Supabase
         try:
-            supabase.storage.from_(config.SUPABASE_STORAGE_BUCKET).upload(
-                file_name, 
-                image_data, 
-                {"content-type": "image/jpeg"}
-            )
-            image_url = f"{config.SUPABASE_URL}/storage/v1/object/public/{config.SUPABASE_STORAGE_BUCKET}/{file_name}"
-            logger.info(f"Изображение успешно загружено. URL: {image_url}")
-            return image_url
+            if variants:
+                variant_urls = {}
+                for name, data in variants.items():
+                    file_name = f"{item['id']}/{name}.{transcode.extension()}"
+                    logger.debug("Загрузка файла {} в Supabase Storage", file_name)
+                    variant_urls[name] = await _upload(file_name, data, transcode.content_type())
+                # В image_url - самый крупный размер
+                image_url = variant_urls[max(transcode.SIZES, key=transcode.SIZES.get)]
+            else:
+                variant_urls = None
+                # Имя файла прежнее, но тип содержимого - настоящий, а не всегда image/jpeg
+                header_type = response.headers.get("content-type", "")
+                content_type = transcode.sniff_content_type(
+                    image_data, header_type if header_type.startswith("image/") else "image/jpeg"
+                )
+                file_name = f"{item['id']}.jpg"
+                logger.debug("Загрузка файла {} в Supabase Storage", file_name)
+                image_url = await _upload(file_name, image_data, content_type)
+            await asyncio.to_thread(image_cache.store, item["id"], img_meta, content_hash, image_url, variant_urls)
+            log_sampled("images", "Изображение успешно загружено. URL: {}", image_url)
+            return transcode.image_fields(image_url, variant_urls)
         except Exception as e:
             logger.error(f"Ошибка при загрузке файла в Supabase: {str(e)}")
             return None
@@ -0,0 +1,13 @@
+from app.core import config
+from app.logger import logger
+from app.services.pagination import iter_rows
+
+async def load_stores() -> dict:
+    """Загружает все склады со всех страниц: {ID склада: название}"""
+    url = f"{config.MS_BASE_URL}/entity/store"
+    logger.info(f"Запрашиваем склады: {url}")
+    stores = {}
+    async for store in iter_rows(url):
+        stores[store["id"]] = store["name"]
+    logger.info(f"Получено {len(stores)} складов")
+    return stores
@@ -0,0 +1,41 @@
+import asyncio
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from app.core import config
+from app.db.supabase_client import supabase
+from app.logger import logger
+
+# Формат дат в фильтрах МойСклад (время московское)
+MS_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def now_watermark() -> str:
+    """
+    Отметка времени для следующего инкрементального прогона. Берётся до начала
+    выборки и сдвигается назад на SYNC_WATERMARK_OVERLAP_SECONDS, чтобы не
+    потерять изменения, попавшие между чтением страниц и сохранением отметки.
+    """
+    moment = datetime.now(ZoneInfo(config.MS_TIMEZONE)) - timedelta(seconds=config.SYNC_WATERMARK_OVERLAP_SECONDS)
+    return moment.strftime(MS_DATETIME_FORMAT)
+
+def updated_since_params(updated_since: str = None) -> dict:
+    # Фильтр МойСклад по дате изменения: только строки, изменённые после отметки
+    if not updated_since:
+        return {}
+    return {"filter": f"updated>={updated_since}"}
+
+async def get_watermark(entity: str) -> str:
+    query = supabase.table("sync_state").select("watermark").eq("entity", entity)
+    result = await asyncio.to_thread(query.execute)
+    if not result.data or not result.data[0].get("watermark"):
+        return None
+    # Supabase отдаёт timestamp в ISO-формате, МойСклад ждёт "YYYY-MM-DD HH:MM:SS"
+    return datetime.fromisoformat(result.data[0]["watermark"]).strftime(MS_DATETIME_FORMAT)
+
+async def set_watermark(entity: str, watermark: str):
+    query = supabase.table("sync_state").upsert({
+        "entity": entity,
+        "watermark": watermark,
+        "updated_at": datetime.utcnow().isoformat(),
+    })
+    await asyncio.to_thread(query.execute)
+    logger.info(f"Отметка синхронизации для {entity}: {watermark}")
@@ -0,0 +1,102 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from app.core import config
+from app.logger import logger
+# Перекодирование изображений (необязательно): без Pillow в Storage загружается оригинал
+from app.services import transcode_worker
+
+FORMATS = {
+    "webp": ("WEBP", "webp", "image/webp"),
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+}
+
+_pool = None
+_warned = False
+
+def parse_sizes(spec: str) -> dict:
+    """'thumb:200,medium:800,full:1600' -> {имя: максимальная сторона в пикселях}"""
+    sizes = {}
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, pixels = part.partition(":")
+        sizes[name.strip()] = int(pixels)
+    if not sizes:
+        raise ValueError(f"Пустой список размеров изображений: {spec!r}")
+    return sizes
+
+SIZES = parse_sizes(config.IMAGE_SIZES)
+
+def enabled() -> bool:
+    global _warned
+    if not config.IMAGE_TRANSCODE:
+        return False
+    if transcode_worker.Image is None:
+        if not _warned:
+            logger.warning("Перекодирование изображений включено, но пакет Pillow не установлен. Загружаем оригиналы")
+            _warned = True
+        return False
+    return True
+
+def profile() -> str:
+    """
+    Настройки перекодирования, с которыми получены файлы в Storage. Хранится
+    в манифесте: после смены размеров или формата изображения перекодируются
+    заново. Пустая строка - загружен оригинал.
+    """
+    if not enabled():
+        return ""
+    sizes = ",".join(f"{name}:{pixels}" for name, pixels in SIZES.items())
+    return f"{config.IMAGE_FORMAT}:{config.IMAGE_QUALITY}:{sizes}"
+
+def image_fields(image_url: str, variants: dict = None) -> dict:
+    # Колонка image_variants пишется только при IMAGE_TRANSCODE: без неё схема таблиц прежняя
+    if config.IMAGE_TRANSCODE:
+        return {"image_url": image_url, "image_variants": variants}
+    return {"image_url": image_url}
+
+def sniff_content_type(data: bytes, default: str = "image/jpeg") -> str:
+    """Тип содержимого по сигнатуре файла: МойСклад отдаёт не только JPEG"""
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return default
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, а не fork: в родительском процессе работают потоки (to_thread, логгер)
+        _pool = ProcessPoolExecutor(
+            max_workers=config.IMAGE_TRANSCODE_PROCESSES or None,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+async def transcode(data: bytes) -> dict:
+    """
+    Перекодирует изображение во все размеры IMAGE_SIZES в пуле процессов,
+    не занимая цикл событий. Возвращает {имя размера: байты}.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_pool(), transcode_worker.transcode, data, SIZES, FORMATS[config.IMAGE_FORMAT][0], config.IMAGE_QUALITY
+    )
+
+def content_type() -> str:
+    return FORMATS[config.IMAGE_FORMAT][2]
+
+def extension() -> str:
+    return FORMATS[config.IMAGE_FORMAT][1]
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
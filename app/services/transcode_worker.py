@@ -0,0 +1,42 @@
+import io
+
+# Код процессов пула перекодирования. Пул запускается через spawn, и дочерний
+# процесс импортирует этот модуль заново, поэтому здесь нельзя импортировать
+# app.logger и app.core.config: иначе каждый процесс добавит свой обработчик
+# на logs/app.log, и файл будут ротировать несколько процессов сразу
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+def transcode(data: bytes, sizes: dict, pil_format: str, quality: int) -> dict:
+    """
+    Выполняется в процессе пула. Изображение декодируется один раз, размеры
+    получаются последовательным уменьшением от большего к меньшему.
+    Возвращает {имя размера: байты}.
+    """
+    image = Image.open(io.BytesIO(data))
+    # JPEG декодируется сразу в уменьшенном масштабе, если самый большой размер это позволяет
+    largest = max(sizes.values())
+    image.draft("RGB", (largest, largest))
+    image = ImageOps.exif_transpose(image)
+    if pil_format == "JPEG":
+        if image.mode in ("RGBA", "LA", "P"):
+            # Прозрачность JPEG не поддерживает - подкладываем белый фон
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+    elif image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() or image.mode == "P" else "RGB")
+
+    result = {}
+    for name, pixels in sorted(sizes.items(), key=lambda item: item[1], reverse=True):
+        # thumbnail не увеличивает изображение: маленький оригинал сохраняется как есть
+        image.thumbnail((pixels, pixels), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, pil_format, quality=quality)
+        result[name] = buffer.getvalue()
+    return result
@@ -1,6 +1,7 @@
 import base64
+import re
 from app.core import config
-from app.logger import logger
+from app.logger import logger, log_sampled
 
 # Создаем заголовки для API МойСклад
 def get_headers():
@@ -9,9 +10,6 @@ def get_headers():
         logger.error("МойСклад токен отсутствует! Проверьте .env файл.")
         return None
         
-    # Логируем для отладки
-    logger.debug(f"Используем токен: {config.MS_TOKEN[:5]}...")
-    
     # Более полный набор заголовков
     # ВНИМАНИЕ: API МойСклад требует строгого формата Accept заголовка!
     headers = {
@@ -23,12 +21,41 @@ def get_headers():
     
     return headers
 
-# Утилита для проверки ответа API
+# Последний сегмент пути до query-параметров (?expand=...) и без завершающего "/"
+_HREF_ID = re.compile(r"(?:[^?]*/)?([^/?]+)/?(?:\?|$)")
+
+# Извлекаем ID сущности из meta.href (или возвращаем сам ID, если передан он)
+def extract_id(href):
+    if not href:
+        return None
+    match = _HREF_ID.match(href)
+    return match.group(1) if match else None
+
+# Одна компактная строка на запрос: метод, путь, статус, задержка, размер ответа.
+# Успешные запросы пишутся выборочно (LOG_SAMPLE_EVERY), ошибки - всегда
 def log_response_details(response, url):
-    logger.info(f"URL запроса: {url}")
-    logger.info(f"Метод запроса: {response.request.method}")
-    logger.info(f"Заголовки запроса: {response.request.headers}")
-    logger.info(f"Статус ответа: {response.status_code}")
-    logger.info(f"Заголовки ответа: {response.headers}")
+    request = response.request
+    try:
+        latency_ms = response.elapsed.total_seconds() * 1000
+    except RuntimeError:
+        # Потоковый ответ ещё не дочитан
+        latency_ms = 0.0
+    size = response.num_bytes_downloaded
+    fields = {
+        "method": request.method,
+        "path": request.url.path,
+        "status": response.status_code,
+        "latency_ms": round(latency_ms, 1),
+        "bytes": size,
+    }
     if response.status_code >= 400:
-        logger.error(f"Тело ответа: {response.text}") 
\ No newline at end of file
+        logger.bind(**fields).error(
+            "{} {} -> {} ({:.0f} мс, {} Б): {}",
+            request.method, request.url.path, response.status_code, latency_ms, size, response.text[:500],
+        )
+        return
+    log_sampled(
+        "http", "{} {} -> {} ({:.0f} мс, {} Б)",
+        request.method, request.url.path, response.status_code, latency_ms, size,
+        **fields,
+    )
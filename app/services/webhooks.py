@@ -0,0 +1,170 @@
+import asyncio
+from app.core import config
+from app.db.supabase_client import supabase
+from app.logger import logger
+from app.services import categories, products, modifications, stock
+from app.services.catalog import catalog_cache
+from app.services.fingerprints import fingerprint_store
+from app.services.http_client import ms_get, ms_post
+from app.services.pagination import iter_rows
+from app.services.product_index import product_ids
+from app.services.reference import reference_cache
+from app.services.stock import stock_tracker
+from app.services.utils import extract_id
+
+# Тип сущности МойСклад -> таблица Supabase. Порядок важен: родители раньше детей
+ENTITY_TABLES = {
+    "productfolder": "categories",
+    "product": "products",
+    "variant": "modifications",
+}
+WEBHOOK_ACTIONS = ("CREATE", "UPDATE", "DELETE")
+
+class WebhookQueue:
+    """
+    Очередь событий вебхуков МойСклад в памяти процесса. Повторные события
+    одной сущности склеиваются (остаётся последнее действие), а накопленные
+    за окно coalesce_seconds изменения применяются пачками не больше
+    batch_size сущностей через обычную логику синхронизации.
+    """
+
+    def __init__(self, coalesce_seconds: float = None, batch_size: int = None):
+        self.coalesce_seconds = coalesce_seconds if coalesce_seconds is not None else config.WEBHOOK_COALESCE_SECONDS
+        self.batch_size = batch_size or config.WEBHOOK_BATCH_SIZE
+        # (тип сущности, ID) -> действие; dict сохраняет порядок поступления
+        self._pending = {}
+        self._has_events = asyncio.Event()
+        self._task = None
+        self.received = 0
+        self.coalesced = 0
+        self.applied = 0
+
+    def push(self, entity_type: str, entity_id: str, action: str):
+        if entity_type not in ENTITY_TABLES or action not in WEBHOOK_ACTIONS:
+            return
+        key = (entity_type, entity_id)
+        self.received += 1
+        if key in self._pending:
+            self.coalesced += 1
+            # CREATE + UPDATE - по-прежнему создание; DELETE перекрывает всё
+            if not (self._pending[key] == "CREATE" and action == "UPDATE"):
+                self._pending[key] = action
+        else:
+            self._pending[key] = action
+        self._has_events.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self._has_events.wait()
+            # Даём повторным событиям той же сущности склеиться
+            await asyncio.sleep(self.coalesce_seconds)
+            while self._pending:
+                keys = list(self._pending)[:self.batch_size]
+                batch = {key: self._pending.pop(key) for key in keys}
+                try:
+                    await apply_events(batch)
+                    self.applied += len(batch)
+                except Exception as e:
+                    logger.error(f"Ошибка при применении событий вебхуков: {str(e)}")
+            self._has_events.clear()
+            catalog_cache.request_update()
+
+async def apply_events(batch: dict):
+    """Применяет пачку {(тип, ID): действие}: родители раньше детей, удаления - в конце"""
+    stores = None
+    for entity_type, table in ENTITY_TABLES.items():
+        upsert_ids = [eid for (etype, eid), action in batch.items() if etype == entity_type and action != "DELETE"]
+        if not upsert_ids:
+            continue
+        rows = iter_rows(
+            f"{config.MS_BASE_URL}/entity/{entity_type}",
+            {"filter": ";".join(f"id={eid}" for eid in upsert_ids)},
+        )
+        if entity_type == "productfolder":
+            await categories.sync_categories(rows=rows)
+            continue
+        if stores is None:
+            stores = await reference_cache.get("stores")
+        stock_index = await stock.load_stock_for(stores, entity_type, upsert_ids)
+        if entity_type == "product":
+            await products.sync_products(stores, stock_index, rows=rows)
+        else:
+            await modifications.sync_modifications(stores, stock_index, rows=rows)
+        logger.info(f"Вебхуки: обновлено {len(upsert_ids)} строк {table}")
+
+    # Удаляем детей раньше родителей, чтобы не нарушить внешние ключи
+    for entity_type, table in reversed(ENTITY_TABLES.items()):
+        delete_ids = [eid for (etype, eid), action in batch.items() if etype == entity_type and action == "DELETE"]
+        if delete_ids:
+            await _delete_rows(table, delete_ids)
+
+async def _delete_rows(table: str, ids: list):
+    if table == "products":
+        # Модификации удаляются вместе с товаром: их отпечатки и остатки тоже больше не действительны
+        result = await asyncio.to_thread(
+            supabase.table("modifications").delete().in_("product_id", ids).execute
+        )
+        _forget_deleted("modifications", [row["id"] for row in result.data])
+    elif table == "categories":
+        result = await asyncio.to_thread(
+            supabase.table("products").update({"category_id": None}).in_("category_id", ids).execute
+        )
+        # Строки товаров изменены в обход синхронизации - их отпечатки неверны
+        await asyncio.to_thread(fingerprint_store.forget, "products", [row["id"] for row in result.data])
+    await asyncio.to_thread(supabase.table(table).delete().in_("id", ids).execute)
+    _forget_deleted(table, ids)
+    catalog_cache.forget(table, ids)
+    logger.info(f"Вебхуки: удалено {len(ids)} строк {table}")
+
+def _forget_deleted(table: str, ids: list):
+    if not ids:
+        return
+    fingerprint_store.forget(table, ids)
+    stock_tracker.forget(ids)
+    if table == "products":
+        product_ids.discard(ids)
+
+def handle_payload(payload: dict) -> int:
+    """Разбирает тело вебхука МойСклад и ставит события в очередь"""
+    events = payload.get("events", [])
+    for event in events:
+        meta = event.get("meta", {})
+        entity_id = extract_id(meta.get("href"))
+        if entity_id:
+            webhook_queue.push(meta.get("type"), entity_id, event.get("action"))
+    return len(events)
+
+async def register_webhooks(callback_url: str) -> list:
+    """
+    Регистрирует в МойСклад вебхуки CREATE/UPDATE/DELETE для товаров,
+    модификаций и групп товаров. Уже существующие подписки не дублируются.
+    """
+    url = f"{config.MS_BASE_URL}/entity/webhook"
+    response = await ms_get(url)
+    response.raise_for_status()
+    existing = {
+        (hook.get("url"), hook.get("entityType"), hook.get("action"))
+        for hook in response.json().get("rows", [])
+    }
+
+    created = []
+    for entity_type in ENTITY_TABLES:
+        for action in WEBHOOK_ACTIONS:
+            if (callback_url, entity_type, action) in existing:
+                continue
+            result = await ms_post(url, json={"url": callback_url, "action": action, "entityType": entity_type})
+            result.raise_for_status()
+            created.append({"entityType": entity_type, "action": action})
+    logger.info(f"Зарегистрировано вебхуков: {len(created)}")
+    return created
+
+webhook_queue = WebhookQueue()
@@ -0,0 +1,21 @@
+import asyncio
+
+# Отдельная точка входа воркера распределённой синхронизации (SHARD_MODE):
+# python -m app.worker. Веб-приложение с планировщиком запускается как обычно.
+# Импорты - внутри main(): процессы пула перекодирования (spawn) заново
+# выполняют этот модуль как __mp_main__ и не должны подключать app.logger
+async def main():
+    from app.logger import logger
+    from app.services import http_client, transcode
+    from app.services.sharding import run_worker
+
+    await http_client.start_client()
+    try:
+        await run_worker()
+    finally:
+        await http_client.close_client()
+        await asyncio.to_thread(transcode.shutdown)
+        logger.info("Воркер остановлен")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,236 @@
+import asyncio
+import json
+import time
+import uuid
+import httpx
+
+# Фейковый МойСклад для нагрузочных прогонов: httpx-транспорт, который отвечает
+# так же, как JSON API 1.2 (пагинация limit/offset, meta.size, фильтры id= и
+# updated>=, отчёт остатков, скачивание изображений с редиректом и 429 при
+# превышении лимита). Строки каталога генерируются на лету по номеру, поэтому
+# сам фейк почти не занимает памяти даже на 100k товаров.
+
+BASE_URL = "http://moysklad.fake/api/remap/1.2"
+_BASE_PATH = "/api/remap/1.2"
+
+# Дата изменения всех сгенерированных строк: инкрементальный прогон после неё ничего не получит
+UPDATED = "2024-01-01 00:00:00"
+
+# Старшие биты UUID - тип сущности, младшие - номер строки
+_KINDS = {"pricetype": 1, "store": 2, "productfolder": 3, "product": 4, "variant": 5, "image": 6}
+
+def make_id(kind: str, index: int) -> str:
+    return str(uuid.UUID(int=(_KINDS[kind] << 64) | index))
+
+def parse_index(entity_id: str) -> tuple:
+    """ID -> (тип сущности, номер строки)"""
+    value = uuid.UUID(entity_id).int
+    kinds = {code: kind for kind, code in _KINDS.items()}
+    return kinds.get(value >> 64), value & ((1 << 64) - 1)
+
+def _meta(kind: str, entity_id: str) -> dict:
+    path = "context/companysettings/pricetype" if kind == "pricetype" else f"entity/{kind}"
+    return {"href": f"{BASE_URL}/{path}/{entity_id}", "type": kind}
+
+class Catalog:
+    """Сгенерированный каталог: товары с группами, модификациями, ценами, остатками и изображениями"""
+
+    def __init__(self, products: int, variants_per_product: int = 2, stores: int = 3,
+                 price_types: int = 2, image_ratio: float = 0.05, image_size: int = 20_000):
+        self.products = products
+        self.variants_per_product = variants_per_product
+        self.folders = max(1, products // 100)
+        self.stores = stores
+        self.price_types = price_types
+        self.image_every = int(1 / image_ratio) if image_ratio > 0 else 0
+        self.image_bytes = b"\xff\xd8\xff" + bytes(max(0, image_size - 3))
+
+    def size(self, kind: str) -> int:
+        return {
+            "store": self.stores,
+            "productfolder": self.folders,
+            "product": self.products,
+            "variant": self.products * self.variants_per_product,
+            "stock": self.products * (1 + self.variants_per_product),
+        }[kind]
+
+    def _prices(self, index: int) -> list:
+        return [
+            {"value": 10000 + index * (p + 1), "priceType": {"meta": _meta("pricetype", make_id("pricetype", p))}}
+            for p in range(self.price_types)
+        ]
+
+    def _images(self, index: int) -> dict:
+        if not self.image_every or index % self.image_every:
+            return {"meta": {"size": 0}, "rows": []}
+        image_id = make_id("image", index)
+        return {
+            "meta": {"size": 1},
+            "rows": [{
+                "meta": {"downloadHref": f"{BASE_URL}/download/{image_id}"},
+                "filename": f"{index}.jpg",
+                "size": len(self.image_bytes),
+                "updated": UPDATED,
+            }],
+        }
+
+    def price_type_rows(self) -> list:
+        return [{"id": make_id("pricetype", p), "name": f"Цена {p}", "meta": _meta("pricetype", make_id("pricetype", p))}
+                for p in range(self.price_types)]
+
+    def row(self, kind: str, index: int) -> dict:
+        entity_id = make_id(kind, index)
+        if kind == "store":
+            return {"id": entity_id, "name": f"Склад {index}", "meta": _meta(kind, entity_id)}
+        if kind == "productfolder":
+            row = {"id": entity_id, "name": f"Группа {index}", "meta": _meta(kind, entity_id), "updated": UPDATED}
+            if index:
+                # Плоское дерево глубины 2: у всех групп, кроме первой, родитель - первая
+                row["productFolder"] = {"meta": _meta(kind, make_id(kind, 0))}
+            return row
+        if kind == "product":
+            return {
+                "id": entity_id,
+                "name": f"Товар {index}",
+                "description": f"Описание товара {index}",
+                "meta": _meta(kind, entity_id),
+                "updated": UPDATED,
+                "productFolder": {"meta": _meta("productfolder", make_id("productfolder", index % self.folders))},
+                "salePrices": self._prices(index),
+                "images": self._images(index),
+            }
+        product_index = index // self.variants_per_product
+        return {
+            "id": entity_id,
+            "name": f"Товар {product_index} / вариант {index % self.variants_per_product}",
+            "meta": _meta(kind, entity_id),
+            "updated": UPDATED,
+            "product": {"meta": _meta("product", make_id("product", product_index))},
+            "characteristics": [{"name": "Размер", "value": str(index % self.variants_per_product)}],
+            "salePrices": self._prices(index),
+            "images": self._images(index),
+        }
+
+    def filter_index(self, kind: str, entity_id: str) -> int:
+        # Номер строки коллекции kind для ID из фильтра; в отчёте остатков модификации идут после товаров
+        entity_kind, index = parse_index(entity_id)
+        if kind == "stock" and entity_kind == "variant":
+            return self.products + index
+        return index
+
+    def stock_row(self, index: int) -> dict:
+        if index < self.products:
+            kind, entity_index = "product", index
+        else:
+            kind, entity_index = "variant", index - self.products
+        entity_id = make_id(kind, entity_index)
+        return {
+            "meta": {"href": f"{BASE_URL}/entity/{kind}/{entity_id}?expand=supplier", "type": kind},
+            "stockByStore": [
+                {"meta": _meta("store", make_id("store", s)), "name": f"Склад {s}", "stock": float((index + s) % 7)}
+                for s in range(self.stores)
+            ],
+        }
+
+class FakeMoySklad(httpx.AsyncBaseTransport):
+    """
+    Транспорт для httpx.AsyncClient вместо сети. latency - задержка ответа
+    (секунды), rate_limit - запросов за rate_period секунд, после которых
+    отдаётся 429 с X-Lognex-Retry-TimeInterval (0 - без ограничения).
+    """
+
+    def __init__(self, catalog: Catalog, latency: float = 0.0, rate_limit: int = 0, rate_period: float = 3.0):
+        self.catalog = catalog
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rate_period = rate_period
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self.requests = 0
+        self.throttled = 0
+        self.bytes_sent = 0
+
+    def _throttle(self) -> float:
+        """0, если запрос можно обслужить, иначе сколько секунд ждать"""
+        if not self.rate_limit:
+            return 0.0
+        now = time.monotonic()
+        if now - self._window_start >= self.rate_period:
+            self._window_start = now
+            self._window_count = 0
+        self._window_count += 1
+        if self._window_count > self.rate_limit:
+            return self.rate_period - (now - self._window_start)
+        return 0.0
+
+    def _remaining(self) -> int:
+        return max(0, self.rate_limit - self._window_count) if self.rate_limit else 1000
+
+    def _json(self, payload, status: int = 200) -> httpx.Response:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.bytes_sent += len(body)
+        return httpx.Response(status, content=body, headers={
+            "Content-Type": "application/json;charset=utf-8",
+            "X-RateLimit-Remaining": str(self._remaining()),
+        })
+
+    def _collection(self, request: httpx.Request, kind: str, row_fn) -> httpx.Response:
+        params = request.url.params
+        limit = min(int(params.get("limit", 1000)), 1000)
+        offset = int(params.get("offset", 0))
+        size = self.catalog.size(kind)
+        indexes = range(offset, min(offset + limit, size))
+
+        filters = [f for f in params.get("filter", "").split(";") if f]
+        updated = [f.split(">=", 1)[1] for f in filters if f.startswith("updated>=")]
+        if updated and updated[0] > UPDATED:
+            size, indexes = 0, range(0)
+        # id=... и <тип сущности>=href (product=, variant= и т.д.) - фильтр по списку позиций
+        id_keys = ("id", *_KINDS)
+        ids = [f.split("=", 1)[1] for f in filters if f.split("=", 1)[0] in id_keys]
+        if ids:
+            # Фильтр по ID (вебхуки, остатки по списку товаров или модификаций): href или голый ID
+            wanted = sorted({
+                self.catalog.filter_index(kind, value.split("?")[0].rstrip("/").split("/")[-1]) for value in ids
+            })
+            wanted = [i for i in wanted if i < size]
+            size, indexes = len(wanted), wanted[offset:offset + limit]
+
+        return self._json({
+            "meta": {"size": size, "limit": limit, "offset": offset},
+            "rows": [row_fn(i) for i in indexes],
+        })
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        wait = self._throttle()
+        if wait > 0:
+            self.throttled += 1
+            response = self._json({"errors": [{"error": "Превышен лимит запросов", "code": 1049}]}, 429)
+            response.headers["X-Lognex-Retry-TimeInterval"] = str(int(wait * 1000))
+            return response
+
+        path = request.url.path
+        if path.startswith(_BASE_PATH):
+            path = path[len(_BASE_PATH):]
+        catalog = self.catalog
+
+        if path == "/context/companysettings/pricetype":
+            return self._json(catalog.price_type_rows())
+        if path == "/report/stock/bystore":
+            return self._collection(request, "stock", catalog.stock_row)
+        if path.startswith("/entity/"):
+            kind = path.split("/")[2]
+            if kind in ("store", "productfolder", "product", "variant"):
+                return self._collection(request, kind, lambda i: catalog.row(kind, i))
+            if kind == "webhook":
+                return self._json({"meta": {"size": 0}, "rows": []})
+        if path.startswith("/download/"):
+            # Как в МойСклад: downloadHref ведёт редиректом на файловое хранилище
+            return httpx.Response(302, headers={"Location": f"http://files.moysklad.fake/{path.split('/')[-1]}"})
+        if request.url.host == "files.moysklad.fake":
+            self.bytes_sent += len(catalog.image_bytes)
+            return httpx.Response(200, content=catalog.image_bytes, headers={"Content-Type": "image/jpeg"})
+        return self._json({"errors": [{"error": f"Неизвестный путь {path}"}]}, 404)
@@ -0,0 +1,125 @@
+import threading
+import time
+
+# Фейковый Supabase: тот же синхронный интерфейс, что использует сервис
+# (table().upsert/update/delete/select + eq/in_/order/range + execute и
+# storage.from_().upload), но данные лежат в памяти процесса. latency -
+# задержка каждого execute/upload, как у сетевого запроса к PostgREST.
+
+class _Result:
+    def __init__(self, data: list):
+        self.data = data
+
+class _Query:
+    def __init__(self, db, table: str):
+        self._db = db
+        self._table = table
+        self._action = "select"
+        self._payload = None
+        self._filters = []
+        self._range = None
+
+    def select(self, columns: str = "*"):
+        self._action = "select"
+        self._payload = None if columns == "*" else [c.strip() for c in columns.split(",")]
+        return self
+
+    def upsert(self, rows):
+        self._action = "upsert"
+        self._payload = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def update(self, fields: dict):
+        self._action = "update"
+        self._payload = fields
+        return self
+
+    def delete(self):
+        self._action = "delete"
+        return self
+
+    def eq(self, column: str, value):
+        self._filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def in_(self, column: str, values):
+        values = set(values)
+        self._filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def order(self, column: str, desc: bool = False):
+        return self
+
+    def range(self, start: int, end: int):
+        self._range = (start, end)
+        return self
+
+    def execute(self) -> _Result:
+        return self._db.execute(self)
+
+class _Bucket:
+    def __init__(self, db):
+        self._db = db
+
+    def upload(self, path: str, data: bytes, options: dict = None):
+        self._db.simulate_latency()
+        with self._db.lock:
+            self._db.files[path] = len(data)
+            self._db.uploaded_bytes += len(data)
+            self._db.calls += 1
+
+class _Storage:
+    def __init__(self, db):
+        self._db = db
+
+    def from_(self, bucket: str) -> _Bucket:
+        return _Bucket(self._db)
+
+class FakeSupabase:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.files = {}
+        self.calls = 0
+        self.rows_upserted = 0
+        self.uploaded_bytes = 0
+        self.storage = _Storage(self)
+
+    def table(self, name: str) -> _Query:
+        return _Query(self, name)
+
+    def simulate_latency(self):
+        if self.latency:
+            # Вызывается из потока asyncio.to_thread, как и настоящий клиент
+            time.sleep(self.latency)
+
+    def execute(self, query: _Query) -> _Result:
+        self.simulate_latency()
+        with self.lock:
+            self.calls += 1
+            rows = self.tables.setdefault(query._table, {})
+            matched = [row for row in rows.values() if all(f(row) for f in query._filters)]
+
+            if query._action == "upsert":
+                for row in query._payload:
+                    key = row.get("id", row.get("entity"))
+                    rows[key] = {**rows.get(key, {}), **row}
+                self.rows_upserted += len(query._payload)
+                return _Result(query._payload)
+            if query._action == "update":
+                for row in matched:
+                    row.update(query._payload)
+                return _Result(matched)
+            if query._action == "delete":
+                for row in matched:
+                    rows.pop(row.get("id", row.get("entity")), None)
+                return _Result(matched)
+
+            matched.sort(key=lambda row: str(row.get("id", "")))
+            if query._range:
+                start, end = query._range
+                matched = matched[start:end + 1]
+            if query._payload:
+                matched = [{c: row.get(c) for c in query._payload} for row in matched]
+            return _Result(matched)
@@ -0,0 +1,177 @@
+"""
+Нагрузочный прогон синхронизации без сети: фейковый МойСклад (benchmarks/fake_moysklad.py)
+и фейковый Supabase (benchmarks/fake_supabase.py) вместо настоящих сервисов.
+
+Каждый размер каталога прогоняется в отдельном процессе, чтобы кэши, индексы
+и пиковая память одного прогона не влияли на другой. Сценарии внутри процесса
+идут по порядку и делят состояние (второй "full" - прогон по тёплым кэшам).
+
+Примеры:
+    python -m benchmarks.run --products 1000 10000
+    python -m benchmarks.run --products 100000 --ms-latency 0.05 --ms-rate 45
+    python -m benchmarks.run --products 10000 --json current.json --baseline baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+SCENARIOS = ("categories", "products", "modifications", "full")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон синхронизации на фейковых МойСклад и Supabase")
+    parser.add_argument("--products", type=int, nargs="+", default=[1000, 10000], help="размеры каталога")
+    parser.add_argument("--variants", type=int, default=2, help="модификаций на товар")
+    parser.add_argument("--image-ratio", type=float, default=0.05, help="доля товаров и модификаций с изображением")
+    parser.add_argument("--image-size", type=int, default=20_000, help="размер изображения, байт")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument("--ms-latency", type=float, default=0.0, help="задержка ответа МойСклад, с")
+    parser.add_argument("--ms-rate", type=int, default=0, help="лимит МойСклад, запросов за 3 с (0 - без лимита)")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="задержка запроса к Supabase, с")
+    parser.add_argument("--trace-memory", action="store_true", help="пик памяти Python по tracemalloc (медленнее)")
+    parser.add_argument("--json", help="сохранить результаты в файл")
+    parser.add_argument("--baseline", help="файл результатов для сравнения по времени")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="допустимое замедление относительно baseline")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def _prepare_environment(data_dir: str):
+    # До импорта app.*: config читает переменные окружения один раз при импорте
+    from benchmarks.fake_moysklad import BASE_URL
+    os.environ.update({
+        "MS_BASE_URL": BASE_URL,
+        "MS_TOKEN": "benchmark",
+        "SUPABASE_URL": "http://supabase.fake",
+        "SUPABASE_KEY": "benchmark",
+        "SUPABASE_STORAGE_BUCKET": "product-images",
+        "DATA_DIR": data_dir,
+    })
+    # Лимиты клиента по умолчанию не должны мерить сами себя; переопределяются окружением
+    os.environ.setdefault("MS_RATE_LIMIT", "100000")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+def _install_fake_supabase(fake):
+    # Все модули берут клиент через "from app.db.supabase_client import supabase"
+    module = types.ModuleType("app.db.supabase_client")
+    module.supabase = fake
+    sys.modules["app.db.supabase_client"] = module
+
+async def _run_worker(args) -> list:
+    import httpx
+    from benchmarks.fake_moysklad import Catalog, FakeMoySklad
+    from benchmarks.fake_supabase import FakeSupabase
+
+    products_count = args.products[0]
+    catalog = Catalog(products_count, args.variants, image_ratio=args.image_ratio, image_size=args.image_size)
+    fake_ms = FakeMoySklad(catalog, latency=args.ms_latency, rate_limit=args.ms_rate)
+    fake_db = FakeSupabase(latency=args.db_latency)
+    _install_fake_supabase(fake_db)
+
+    from app.main import run_full_sync
+    from app.services import categories, products, modifications, http_client
+    from app.services.utils import get_headers
+
+    http_client._client = httpx.AsyncClient(transport=fake_ms, headers=get_headers())
+    scenarios = {
+        "categories": categories.sync_categories,
+        "products": products.sync_products,
+        "modifications": modifications.sync_modifications,
+        "full": run_full_sync,
+    }
+
+    results = []
+    for name in args.scenarios:
+        requests_before, rows_before = fake_ms.requests, fake_db.rows_upserted
+        if args.trace_memory:
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        outcome = await scenarios[name]()
+        wall = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+        if args.trace_memory:
+            tracemalloc.stop()
+
+        rows = fake_db.rows_upserted - rows_before
+        results.append({
+            "products": products_count,
+            "scenario": name,
+            "ok": outcome is not False,
+            "wall_seconds": round(wall, 3),
+            "requests": fake_ms.requests - requests_before,
+            "throttled": fake_ms.throttled,
+            "rows_written": rows,
+            "rows_per_second": round(rows / wall, 1) if wall > 0 else 0.0,
+            "peak_python_mb": round(peak / 2**20, 1) if peak is not None else None,
+            # ru_maxrss в Linux - в килобайтах, пик за всю жизнь процесса
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        })
+    await http_client.close_client()
+    return results
+
+def _spawn(args, products_count: int) -> list:
+    argv = [sys.executable, "-m", "benchmarks.run", "--worker", "--products", str(products_count)]
+    argv += ["--variants", str(args.variants), "--image-ratio", str(args.image_ratio),
+             "--image-size", str(args.image_size), "--ms-latency", str(args.ms_latency),
+             "--ms-rate", str(args.ms_rate), "--db-latency", str(args.db_latency),
+             "--scenarios", *args.scenarios]
+    if args.trace_memory:
+        argv.append("--trace-memory")
+    completed = subprocess.run(argv, capture_output=True, text=True)
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr)
+        raise SystemExit(f"Прогон на {products_count} товаров завершился с ошибкой")
+    # Последняя строка вывода воркера - JSON с результатами
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def _print_table(results: list):
+    columns = ("products", "scenario", "ok", "wall_seconds", "requests", "throttled",
+               "rows_written", "rows_per_second", "peak_python_mb", "max_rss_mb")
+    widths = [max(len(c), *(len(str(r[c])) for r in results)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for result in results:
+        print("  ".join(str(result[c]).ljust(w) for c, w in zip(columns, widths)))
+
+def _compare(results: list, baseline_path: str, max_regression: float) -> bool:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["products"], r["scenario"]): r for r in json.load(f)}
+    ok = True
+    for result in results:
+        base = baseline.get((result["products"], result["scenario"]))
+        if not base or not base["wall_seconds"]:
+            continue
+        change = result["wall_seconds"] / base["wall_seconds"] - 1
+        if change > max_regression:
+            ok = False
+            print(f"Замедление {result['scenario']} на {result['products']} товаров: "
+                  f"{base['wall_seconds']} с -> {result['wall_seconds']} с ({change:+.0%})")
+    return ok
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.worker:
+        with tempfile.TemporaryDirectory(prefix="ms-bench-") as data_dir:
+            _prepare_environment(data_dir)
+            results = asyncio.run(_run_worker(args))
+        print(json.dumps(results))
+        return
+
+    results = []
+    for products_count in args.products:
+        results.extend(_spawn(args, products_count))
+    _print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.baseline and not _compare(results, args.baseline, args.max_regression):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,7 @@ create table if not exists public.products (
   name text not null,
   description text,
   image_url text,
+  image_variants jsonb,
   category_id uuid references public.categories(id),
   prices jsonb,
   stock jsonb,
@@ -25,6 +26,7 @@ create table if not exists public.modifications (
   name text,
   characteristics jsonb,
   image_url text,
+  image_variants jsonb,
   prices jsonb,
   stock jsonb,
   created_at timestamp default now()
@@ -48,3 +50,16 @@ alter table public.products enable row level security;
 alter table public.modifications enable row level security;
 alter table public.sync_status enable row level security;
 -- alter table public.stores enable row level security;
+
+-- Отметки инкрементальной синхронизации (по типу сущности)
+create table if not exists public.sync_state (
+  entity text primary key,
+  watermark timestamp,
+  updated_at timestamp default now()
+);
+
+alter table public.sync_state enable row level security;
+
+-- URL размеров перекодированных изображений (IMAGE_TRANSCODE) для уже созданных таблиц
+alter table public.products add column if not exists image_variants jsonb;
+alter table public.modifications add column if not exists image_variants jsonb;